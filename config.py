@@ -1,9 +1,14 @@
 # ---------- GLOBAL CONFIGURATION ----------
 
 # Image settings
-IMAGE_SIZE = (256, 256)   # or whatever size
+IMAGE_SIZE = (256, 256)   # (W, H), or None to keep native resolution
 INDEXED_COLORS = 256
 
+# Colour quantizer: "mediancut", "maxcoverage", "fastoctree", "rgb332"
+QUANTIZER = "mediancut"
+# Number of shared palettes kept for palette_key reuse
+PALETTE_CACHE_SIZE = 32
+
 # Chaotic system parameters
 A = 3.99
 B = 3.99
@@ -12,12 +17,42 @@ X0 = 0.345
 
 TRANSIENT_ITER = 100
 
+# Number of Hilbert tables (one per grid size) kept in memory
+HILBERT_CACHE_SIZE = 8
+
 # Fractal matrix order
 FRACTAL_ORDER = 5
 
 # Security parameters
 KEY_LENGTH = 256
 
+# Execution engine: "reference", "vectorized" or "auto"
+ENGINE = "auto"
+# "auto" picks, for an image of P pixels, the first engine whose
+# max_pixels >= P (None = any size); see modules.engines.calibrate
+ENGINE_CALIBRATION = ((None, "vectorized"),)
+
+# Tiled mode: side of the square tiles
+TILE_SIZE = 256
+
+# Key schedule on-disk store
+SCHEDULE_STORE_PATH = "cache/key_schedules/"
+SCHEDULE_STORE_MAX_BYTES = 2 * 1024 ** 3
+
+# Multi-key batch engine (modules/multikey.py): keys per lattice run
+MULTIKEY_BATCH = 256
+
+# Key schedules / diffusion workspaces each batch worker keeps (per size)
+WORKER_CACHE_SIZE = 4
+
+# Local encryption service (modules/server.py)
+SERVER_SOCKET_PATH = "/tmp/multi_image_encryption.sock"
+SERVER_MAX_QUEUE = 256            # queued requests before clients block
+SERVER_MAX_BATCH = 32             # requests drained per micro-batch
+SERVER_BATCH_WINDOW = 0.002       # seconds to wait for a batch to fill
+SERVER_SCHEDULE_CACHE = 16        # key schedules kept per worker
+SERVER_MAX_PAYLOAD = 256 * 1024 ** 2
+
 # Paths
 INPUT_PATH = "images/input/"
 OUTPUT_PATH = "images/output/"
@@ -2,6 +2,7 @@ import numpy as np
 import config
 from modules import image_utils, encryption, decryption
 from modules import analysis
+from modules.key_schedule import build_key_schedule
 def main():
 
     img1 = config.INPUT_PATH + "img1.png"
@@ -14,16 +15,17 @@ def main():
         image_utils.prepare_indexed_images(P1_rgb, P2_rgb, P3_rgb)
 
     user_key = "sssskksksa"
+    key_schedule = build_key_schedule(user_key, *I1_index.shape)
 
     cipher_image = encryption.encrypt_three_images(
-        I1_index, I2_index, I3_index, user_key
+        I1_index, I2_index, I3_index, key_schedule
     )
     
     image_utils.save_image(cipher_image, "final_cipher.png")
     print("[SUCCESS] Encryption completed.")
 
     P1_dec, P2_dec, P3_dec = decryption.decrypt_three_images(
-        cipher_image, user_key, MAP1, MAP2, MAP3
+        cipher_image, key_schedule, MAP1, MAP2, MAP3
     )
     print("Original R sum:", np.sum(P1_rgb[:, :, 0]))
     print("Decrypted R sum:", np.sum(P1_dec[:, :, 0]))
@@ -0,0 +1,4 @@
+import sys
+from modules import cli
+
+sys.exit(cli.main())
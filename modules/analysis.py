@@ -1,8 +1,11 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.stats import pearsonr
 from skimage.metrics import structural_similarity as ssim
 from modules import encryption
+from modules import instrument
+from modules import metrics
 import time
 
 
@@ -10,152 +13,253 @@ import time
 # BASIC METRICS
 # ===============================
 
+def _pixel_histogram(channel):
+    # one histogram over every value, as np.histogram(channel.flatten())
+    return metrics.channel_histograms(np.ravel(channel)[None, :])
+
+
 def entropy(channel):
-    hist, _ = np.histogram(channel.flatten(), bins=256, range=(0, 256))
-    p = hist / hist.sum()
-    p = p[p > 0]
-    return float(-(p * np.log2(p)).sum())
+    return float(metrics.entropy_from_hist(_pixel_histogram(channel))[0])
+
 
 
+def _pixel_correlation(channel, direction):
+    # one coefficient over every neighbour pair of every channel, as
+    # pearsonr on the flattened views
+    x, y = metrics._neighbour_views(np.asarray(channel), direction)
+    return metrics._pearson(np.ravel(x)[:, None, None],
+                            np.ravel(y)[:, None, None])
+
 
 def correlation(channel, direction="horizontal"):
-    if direction == "horizontal":
-        x = channel[:, :-1].flatten()
-        y = channel[:, 1:].flatten()
-    elif direction == "vertical":
-        x = channel[:-1, :].flatten()
-        y = channel[1:, :].flatten()
-    else:  # diagonal
-        x = channel[:-1, :-1].flatten()
-        y = channel[1:, 1:].flatten()
-    return float(pearsonr(x, y)[0])
+    return float(_pixel_correlation(channel, direction)[0])
 
 
 def npcr(img1, img2):
     assert img1.shape == img2.shape
-    diff = img1 != img2
-    return diff.sum() * 100.0 / diff.size
+    return float(metrics.npcr(img1, img2).mean())
 
 
 def uaci(img1, img2):
     assert img1.shape == img2.shape
-    diff = np.abs(img1.astype(np.int16) - img2.astype(np.int16))
-    return diff.mean() * 100.0 / 255.0
+    return float(metrics.uaci(img1, img2).mean())
 
 
 def chi_square(channel):
-    hist, _ = np.histogram(channel.flatten(), bins=256, range=(0, 256))
-    expected = channel.size / 256.0
-    return float(((hist - expected) ** 2 / expected).sum())
+    return float(metrics.chi_square_from_hist(_pixel_histogram(channel))[0])
 
 
 def mse(img1, img2):
     return float(np.mean((img1.astype(float) - img2.astype(float)) ** 2))
 
 
-def psnr(img1, img2):
-    m = mse(img1, img2)
+def _psnr_from_mse(m):
     if m == 0:
         return float("inf")
     return float(10.0 * np.log10((255.0 ** 2) / m))
 
 
+def psnr(img1, img2):
+    return _psnr_from_mse(mse(img1, img2))
+
+
 # ===============================
 # MAIN ANALYSIS FUNCTION
 # ===============================
 
+ANALYSIS_TESTS = (
+    "entropy",
+    "correlation",
+    "key_sensitivity",
+    "chi_square",
+    "encryption_quality",
+    "decryption_quality",
+    "histogram",
+    "timing",
+)
+
+
+def image_quality(img1, img2):
+    """
+    MSE, PSNR and SSIM of two RGB images.
+    """
+    m = mse(img1, img2)
+    return {
+        "mse": m,
+        "psnr": _psnr_from_mse(m),
+        "ssim": float(ssim(img1, img2, channel_axis=2, data_range=255)),
+    }
+
+
+def plot_histograms(hists, path="cipher_histogram.png"):
+    """
+    Save per-channel histograms, drawn from precomputed (3, 256) counts.
+    """
+    colors = ["r", "g", "b"]
+    edges = np.arange(257)
+    plt.figure(figsize=(12, 4))
+    for i, ch_name in enumerate(["R", "G", "B"]):
+        plt.subplot(1, 3, i + 1)
+        plt.stairs(hists[i], edges, fill=True, color=colors[i])
+        plt.title(f"Cipher {ch_name}")
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+    return path
+
+
+def _print_quality(results):
+    for name, q in results.items():
+        print(f"\n{name}:")
+        print("MSE:", q["mse"])
+        print("PSNR:", q["psnr"])
+        print("SSIM:", q["ssim"])
+
+
 def run_full_analysis(
     I1_index, I2_index, I3_index,
     cipher_image,
     P1_quant, P2_quant, P3_quant,
     P1_dec, P2_dec, P3_dec,
-    user_key
+    user_key,
+    tests=None,
+    workers=None,
+    histogram_path="cipher_histogram.png"
 ):
+    """
+    user_key is the key string, or a KeySchedule built for the images'
+    size when "key_sensitivity" is not among the tests (that test needs
+    the string to derive a modified key; a ValueError is raised if it
+    is selected with a schedule).
+
+    tests selects a subset of ANALYSIS_TESTS (default: all). The cipher
+    statistics are computed once, the image quality metrics run on a
+    thread pool of `workers` threads, and the key sensitivity cipher is
+    the one that gets timed (a full encryption from the key string, key
+    schedule included), so the whole report costs about one extra
+    encryption. Given a schedule, the timing test times only the
+    permutation and diffusion stages. Returns a dict with the results of the selected tests;
+    "stages" holds the per-stage timings (see instrument) of the timed run.
+    """
+    tests = ANALYSIS_TESTS if tests is None else tuple(tests)
+    unknown = set(tests) - set(ANALYSIS_TESTS)
+    if unknown:
+        raise ValueError(f"Unknown analysis tests: {sorted(unknown)}")
+    if "key_sensitivity" in tests and not isinstance(user_key, str):
+        raise ValueError("The key sensitivity test needs the key string, "
+                         "not a key schedule")
+
+    results = {}
+
     print("\n==============================")
     print(" ENCRYPTION PERFORMANCE TEST ")
     print("==============================")
 
-    # 1) ENTROPY ANALYSIS (cipher RGB)
-    print("\n--- Information Entropy (Cipher RGB) ---")
-    for i, ch_name in enumerate(["R", "G", "B"]):
-        print(f"{ch_name} channel entropy:",
-              entropy(cipher_image[:, :, i]))
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
 
-    # 2) CORRELATION ANALYSIS (cipher RGB)
-    print("\n--- Correlation (Cipher Image) ---")
-    for i, ch_name in enumerate(["R", "G", "B"]):
-        ch = cipher_image[:, :, i]
-        print(f"\n{ch_name} Channel:")
-        print("Horizontal:", correlation(ch, "horizontal"))
-        print("Vertical:",   correlation(ch, "vertical"))
-        print("Diagonal:",   correlation(ch, "diagonal"))
+        # SSIM dominates the report: start it before anything else
+        quality = {}
+        if "encryption_quality" in tests:
+            quality["encryption_quality"] = {
+                name: pool.submit(image_quality, plain, cipher_image)
+                for name, plain in [("Img1", P1_quant),
+                                    ("Img2", P2_quant),
+                                    ("Img3", P3_quant)]
+            }
+        if "decryption_quality" in tests:
+            quality["decryption_quality"] = {
+                name: pool.submit(image_quality, orig, dec)
+                for name, orig, dec in [("Img1", P1_quant, P1_dec),
+                                        ("Img2", P2_quant, P2_dec),
+                                        ("Img3", P3_quant, P3_dec)]
+            }
 
-    # 3) KEY SENSITIVITY (NPCR / UACI between two ciphers)
-    print("\n--- Key Sensitivity Test ---")
-    user_key_modified = user_key+"1"
+        cipher_stats = None
+        if {"entropy", "correlation", "chi_square", "histogram"} & set(tests):
+            cipher_stats = metrics.image_metrics(cipher_image)
+            results["cipher"] = cipher_stats
 
-    cipher_mod = encryption.encrypt_three_images(
-        I1_index, I2_index, I3_index, user_key_modified
-    )
+        # 1) ENTROPY ANALYSIS (cipher RGB)
+        if "entropy" in tests:
+            print("\n--- Information Entropy (Cipher RGB) ---")
+            for ch_name, stats in cipher_stats.items():
+                print(f"{ch_name} channel entropy:", stats["entropy"])
 
-    for i, ch_name in enumerate(["R", "G", "B"]):
-        print(f"\n{ch_name} Channel:")
-        print("NPCR:", npcr(cipher_image[:, :, i], cipher_mod[:, :, i]))
-        print("UACI:", uaci(cipher_image[:, :, i], cipher_mod[:, :, i]))
+        # 2) CORRELATION ANALYSIS (cipher RGB)
+        if "correlation" in tests:
+            print("\n--- Correlation (Cipher Image) ---")
+            for ch_name, stats in cipher_stats.items():
+                corr = stats["correlation"]
+                print(f"\n{ch_name} Channel:")
+                print("Horizontal:", corr["horizontal"])
+                print("Vertical:",   corr["vertical"])
+                print("Diagonal:",   corr["diagonal"])
 
-    # 4) CHI-SQUARE TEST (cipher RGB)
-    print("\n--- Chi-Square Test (Cipher RGB) ---")
-    for i, ch_name in enumerate(["R", "G", "B"]):
-        chi = chi_square(cipher_image[:, :, i])
-        print(f"{ch_name} channel χ²:", chi)
-
-    # 5) ENCRYPTION QUALITY (Plain vs Cipher)
-    print("\n--- Encryption Quality (Plain vs Cipher) ---")
-    for plain, name in [(P1_quant, "Img1"),
-                        (P2_quant, "Img2"),
-                        (P3_quant, "Img3")]:
-        print(f"\n{name}:")
-        print("MSE:", mse(plain, cipher_image))
-        print("PSNR:", psnr(plain, cipher_image))
-        print("SSIM:", ssim(plain, cipher_image,
-                             channel_axis=2, data_range=255))
-
-    # 6) DECRYPTION QUALITY (Plain vs Decrypted)
-    print("\n--- Decryption Quality ---")
-    for name, orig, dec in [
-        ("Img1", P1_quant, P1_dec),
-        ("Img2", P2_quant, P2_dec),
-        ("Img3", P3_quant, P3_dec),
-    ]:
-        print(f"\n{name}:")
-        print("MSE:", mse(orig, dec))
-        print("PSNR:", psnr(orig, dec))
-        print("SSIM:", ssim(orig, dec,
-                             channel_axis=2, data_range=255))
+        # 3) KEY SENSITIVITY (NPCR / UACI between two ciphers)
+        enc_time = stages = None
+        if "key_sensitivity" in tests:
+            print("\n--- Key Sensitivity Test ---")
+            user_key_modified = user_key+"1"
 
-   # 7) HISTOGRAM PLOT (cipher RGB)
-    print("\n--- Generating Histogram Plots ---")
-    colors = ["r", "g", "b"]
-    plt.figure(figsize=(12, 4))
-    for i, ch_name in enumerate(["R", "G", "B"]):
-        plt.subplot(1, 3, i + 1)
-        plt.hist(cipher_image[:, :, i].flatten(),
-                 bins=256, color=colors[i])
-        plt.title(f"Cipher {ch_name}")
-    plt.tight_layout()
-    plt.savefig("cipher_histogram.png")
-    plt.close()
-    print("Histogram saved as cipher_histogram.png")
+            # timed as a full encryption from the key string, schedule
+            # included; reused by the timing test below
+            with instrument.record_stages(memory=False) as stages:
+                start = time.perf_counter()
+                cipher_mod = encryption.encrypt_three_images(
+                    I1_index, I2_index, I3_index, user_key_modified
+                )
+                enc_time = time.perf_counter() - start
 
-    # 8) EXECUTION TIME TEST
-    print("\n--- Execution Time Test ---")
-    start = time.time()
-    _ = encryption.encrypt_three_images(
-        I1_index, I2_index, I3_index, user_key
-    )
-    enc_time = time.time() - start
-    print("Encryption Time:", enc_time, "seconds")
+            diff = metrics.difference_metrics(cipher_image, cipher_mod)
+            results["key_sensitivity"] = diff
+            for ch_name, d in diff.items():
+                print(f"\n{ch_name} Channel:")
+                print("NPCR:", d["npcr"])
+                print("UACI:", d["uaci"])
+
+        # 4) CHI-SQUARE TEST (cipher RGB)
+        if "chi_square" in tests:
+            print("\n--- Chi-Square Test (Cipher RGB) ---")
+            for ch_name, stats in cipher_stats.items():
+                print(f"{ch_name} channel χ²:", stats["chi_square"])
+
+        # 5) ENCRYPTION QUALITY (Plain vs Cipher)
+        # 6) DECRYPTION QUALITY (Plain vs Decrypted)
+        for test, title in [
+            ("encryption_quality", "Encryption Quality (Plain vs Cipher)"),
+            ("decryption_quality", "Decryption Quality"),
+        ]:
+            if test in quality:
+                print(f"\n--- {title} ---")
+                results[test] = {name: fut.result()
+                                 for name, fut in quality[test].items()}
+                _print_quality(results[test])
+
+    # 7) HISTOGRAM PLOT (cipher RGB)
+    if "histogram" in tests:
+        print("\n--- Generating Histogram Plots ---")
+        hists = [stats["histogram"] for stats in cipher_stats.values()]
+        results["histogram"] = plot_histograms(hists, histogram_path)
+        print(f"Histogram saved as {histogram_path}")
+
+    # 8) EXECUTION TIME TEST (full encryption, key schedule included
+    #    unless user_key already is a schedule)
+    if "timing" in tests:
+        print("\n--- Execution Time Test ---")
+        if enc_time is None:
+            with instrument.record_stages(memory=False) as stages:
+                start = time.perf_counter()
+                encryption.encrypt_three_images(
+                    I1_index, I2_index, I3_index, user_key
+                )
+                enc_time = time.perf_counter() - start
+        results["timing"] = enc_time
+        results["stages"] = stages.summary()
+        print("Encryption Time:", enc_time, "seconds")
+        print(stages.report())
 
     print("\n==============================")
     print(" ANALYSIS COMPLETE ")
-    print("==============================") 
\ No newline at end of file
+    print("==============================")
+
+    return results
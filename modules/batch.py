@@ -0,0 +1,166 @@
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import config
+from modules import encryption
+from modules import decryption
+from modules.key_schedule import build_key_schedule
+from modules.schedule_store import ScheduleStore
+from modules.workspace import DiffusionWorkspace
+
+
+# ==========================================================
+# PER-WORKER STATE
+# ==========================================================
+
+# Set once per worker process by _init_worker; each worker keeps the key
+# schedules (and diffusion workspaces) of its most recent image sizes.
+_worker_key = None
+_worker_store = None
+_worker_schedules = OrderedDict()
+_worker_workspaces = OrderedDict()
+
+
+def lru_lookup(cache, key, build, limit):
+    """
+    cache[key] from an OrderedDict, calling build() on a miss; entries
+    beyond the `limit` most recently used are dropped.
+    """
+    value = cache.pop(key, None)
+    if value is None:
+        value = build()
+    cache[key] = value
+    while len(cache) > limit:
+        cache.popitem(last=False)
+    return value
+
+
+def _init_worker(user_key, store_root):
+    global _worker_key, _worker_store
+    _worker_key = user_key
+    _worker_schedules.clear()
+    _worker_workspaces.clear()
+    if store_root is not None:
+        _worker_store = ScheduleStore(store_root)
+    else:
+        _worker_store = None
+
+
+def worker_key():
+    return _worker_key
+
+
+def _build_worker_schedule(H, W):
+    if _worker_store is not None:
+        return _worker_store.get_or_build(_worker_key, H, W)
+    return build_key_schedule(_worker_key, H, W)
+
+
+def worker_schedule(H, W):
+    """
+    Key schedule for an H×W image in the current worker (built on first use).
+    """
+    return lru_lookup(_worker_schedules, (H, W),
+                      lambda: _build_worker_schedule(H, W),
+                      config.WORKER_CACHE_SIZE)
+
+
+def worker_workspace(H, W):
+    """
+    Diffusion buffers for an H×W image in the current worker, reused by
+    every job of that size.
+    """
+    return lru_lookup(_worker_workspaces, (H, W),
+                      lambda: DiffusionWorkspace(H, W),
+                      config.WORKER_CACHE_SIZE)
+
+
+def _encrypt_job(triple):
+    I1, I2, I3 = triple
+    ks = worker_schedule(*I1.shape)
+    return encryption.encrypt_three_images(I1, I2, I3, ks,
+                                           workspace=worker_workspace(*I1.shape))
+
+
+def _decrypt_job(item):
+    C, MAP1, MAP2, MAP3 = item
+    H, W = C.shape[0], C.shape[1]
+    ks = worker_schedule(H, W)
+    return decryption.decrypt_three_images(C, ks, MAP1, MAP2, MAP3,
+                                           workspace=worker_workspace(H, W))
+
+
+# ==========================================================
+# BATCH DRIVER
+# ==========================================================
+
+def map_with_key(job, items, user_key, workers=None, ordered=True,
+                 max_in_flight=None, store_root=None):
+    """
+    Run job(item) for every item on a process pool whose workers are
+    initialised with user_key; jobs get their schedule from
+    worker_schedule(H, W). job must be a module-level function.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1:
+        _init_worker(user_key, store_root)
+        for i, item in enumerate(items):
+            yield job(item) if ordered else (i, job(item))
+        return
+
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_worker,
+                             initargs=(user_key, store_root)) as pool:
+        items = enumerate(items)
+        pending = deque()
+
+        def fill():
+            while len(pending) < max_in_flight:
+                try:
+                    i, item = next(items)
+                except StopIteration:
+                    return
+                pending.append((pool.submit(job, item), i))
+
+        fill()
+        while pending:
+            if ordered:
+                fut, _ = pending.popleft()
+                yield fut.result()
+            else:
+                index = dict(pending)
+                done, _ = wait(index, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    pending.remove((fut, index[fut]))
+                    yield index[fut], fut.result()
+            fill()
+
+
+def encrypt_batch(triples, user_key: str, workers=None, ordered=True,
+                  max_in_flight=None, store_root=None):
+    """
+    Encrypt an iterable of (I1, I2, I3) index-image triples with one key.
+
+    Triples are spread over a process pool; each worker builds the key
+    schedule once per image size (or opens it from a ScheduleStore at
+    store_root). At most max_in_flight triples (default 2 * workers) are
+    queued at a time. Ciphers are yielded in input order, or as
+    (position, cipher) pairs in completion order when ordered=False.
+    """
+    return map_with_key(_encrypt_job, triples, user_key, workers, ordered,
+                      max_in_flight, store_root)
+
+
+def decrypt_batch(items, user_key: str, workers=None, ordered=True,
+                  max_in_flight=None, store_root=None):
+    """
+    Decrypt an iterable of (C, MAP1, MAP2, MAP3) items with one key.
+    Yields (P1_dec, P2_dec, P3_dec) per item; see encrypt_batch.
+    """
+    return map_with_key(_decrypt_job, items, user_key, workers, ordered,
+                      max_in_flight, store_root)
@@ -0,0 +1,316 @@
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import numpy as np
+from modules import cicsml
+from modules import decryption
+from modules import encryption
+from modules import fractal
+from modules import hilbert
+from modules import image_utils
+from modules.key_schedule import (ALGORITHM_VERSION, build_key_schedule,
+                                  derive_key_parts)
+from modules.workspace import DiffusionWorkspace
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+SIZES = (64, 128, 256, 512, 1024, 2048, 4096)
+STAGES = (
+    "derive_key_parts",
+    "build_fractal_matrix",
+    "generate_hilbert_indices",
+    "cicsml_generate",
+    "synchronized_disorder_diffusion",
+    "synchronized_disorder_diffusion_decrypt",
+    "indexed_image_conversion",
+    "indexed_to_rgb",
+    "encrypt_three_images",
+    "decrypt_three_images",
+)
+
+BENCH_KEY = "benchmark-key"
+SEED = 1234
+DEFAULT_THRESHOLD = 0.10
+# slowdowns smaller than this (seconds) are timer noise, never flagged
+DEFAULT_MIN_DELTA = 1e-4
+
+
+# ==========================================================
+# SYNTHETIC INPUTS
+# ==========================================================
+
+def synthetic_rgb(n, seed=SEED):
+    """
+    Reproducible n×n RGB test image: smooth gradients plus noise, so the
+    quantizers see a realistic colour spread.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:n, 0:n].astype(np.float32) / max(n - 1, 1)
+    img = np.stack([x, y, 1.0 - (x + y) / 2], axis=-1) * 200.0
+    img += rng.normal(0.0, 20.0, img.shape).astype(np.float32)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def synthetic_indexed(n, seed=SEED):
+    """
+    Three reproducible n×n index planes and their palettes.
+    """
+    rng = np.random.default_rng(seed)
+    planes = [rng.integers(0, 256, (n, n), dtype=np.uint8) for _ in range(3)]
+    palettes = [rng.integers(0, 256, 768).tolist() for _ in range(3)]
+    return planes, palettes
+
+
+# ==========================================================
+# MEASUREMENT
+# ==========================================================
+
+def _reset_peak_rss():
+    """
+    Reset the kernel's high-water mark (Linux); False if unsupported.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # lifetime peak; ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _time(fn, repeat, min_time):
+    """
+    Run fn once to warm up, then at least `repeat` times and until
+    min_time seconds have passed (at most 10 * repeat runs).
+    """
+    fn()
+    times = []
+    while (len(times) < repeat
+           or (sum(times) < min_time and len(times) < 10 * repeat)):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _stage_calls(n, stages=STAGES):
+    """
+    (stage, nbytes, fn) for the selected stages at size n. nbytes is the
+    image data the stage serves (three index planes or one RGB image,
+    3·n²). The key schedule is only built when a stage needs it.
+    """
+    L = n * n
+    nbytes = 3 * L
+    (I1, I2, I3), palettes = synthetic_indexed(n)
+    rgb = synthetic_rgb(n)
+
+    Keys = derive_key_parts(BENCH_KEY)
+    a, b, x0, p0 = cicsml.derive_initial_conditions_from_key(BENCH_KEY)
+    if {"synchronized_disorder_diffusion",
+            "synchronized_disorder_diffusion_decrypt",
+            "decrypt_three_images"} & set(stages):
+        ks = build_key_schedule(BENCH_KEY, n, n)
+        ws = DiffusionWorkspace(n, n)
+        C = encryption.encrypt_three_images(I1, I2, I3, ks)
+    index_matrix, palette = image_utils.indexed_image_conversion(rgb)
+
+    calls = [
+        ("derive_key_parts", nbytes,
+         lambda: derive_key_parts(BENCH_KEY)),
+        ("build_fractal_matrix", nbytes,
+         lambda: fractal.build_fractal_matrix(n, n, Keys)),
+        # the uncached table, not the lru_cache hit
+        ("generate_hilbert_indices", nbytes,
+         lambda: hilbert.generate_hilbert_indices.__wrapped__(n)),
+        ("cicsml_generate", nbytes,
+         lambda: cicsml.cicsml_generate(8 * L, a=a, b=b, p0=p0, x0=x0)),
+        ("synchronized_disorder_diffusion", nbytes,
+         lambda: encryption.synchronized_disorder_diffusion(
+             I1, I2, I3, ks.IC1, ks.IC2, ks.Fmat, *ks.keystreams,
+             workspace=ws)),
+        ("synchronized_disorder_diffusion_decrypt", nbytes,
+         lambda: decryption.synchronized_disorder_diffusion_decrypt(
+             C[:, :, 0], C[:, :, 1], C[:, :, 2],
+             ks.IC1, ks.IC2, ks.Fmat, *ks.keystreams, workspace=ws)),
+        ("indexed_image_conversion", nbytes,
+         lambda: image_utils.indexed_image_conversion(rgb)),
+        ("indexed_to_rgb", nbytes,
+         lambda: image_utils.indexed_to_rgb(index_matrix, palette)),
+        # full round trip halves: key string in, schedule built each call
+        ("encrypt_three_images", nbytes,
+         lambda: encryption.encrypt_three_images(I1, I2, I3, BENCH_KEY)),
+        ("decrypt_three_images", nbytes,
+         lambda: decryption.decrypt_three_images(C, BENCH_KEY, *palettes)),
+    ]
+    return [c for c in calls if c[0] in stages]
+
+
+def _log_stderr(line):
+    print(line, file=sys.stderr)
+
+
+def run_benchmarks(sizes=SIZES, stages=STAGES, repeat=3, min_time=0.2,
+                   log=_log_stderr):
+    """
+    Time every selected stage at every size; returns the JSON-ready
+    report {"meta": {...}, "results": [{stage, size, ...}, ...]}.
+    Progress lines go to log (stderr by default, so stdout stays JSON).
+    """
+    results = []
+    for n in sizes:
+        for stage, nbytes, fn in _stage_calls(n, stages):
+            _reset_peak_rss()
+            times = _time(fn, repeat, min_time)
+            best = min(times)
+            row = {
+                "stage": stage,
+                "size": n,
+                "bytes": nbytes,
+                "repeats": len(times),
+                "best_s": best,
+                "median_s": statistics.median(times),
+                "mb_per_s": nbytes / 1e6 / best if best > 0 else None,
+                "peak_rss_bytes": _peak_rss(),
+            }
+            results.append(row)
+            if log is not None:
+                rss = row["peak_rss_bytes"]
+                log(f"{stage:<42}{n:>6}  {best * 1e3:>11.3f} ms  "
+                    f"{row['mb_per_s']:>10.2f} MB/s  "
+                    + ("-" if rss is None else f"{rss / 2**20:>8.1f} MiB"))
+
+    meta = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "algorithm_version": ALGORITHM_VERSION,
+        "seed": SEED,
+        "key": BENCH_KEY,
+        "repeat": repeat,
+        "min_time": min_time,
+    }
+    return {"meta": meta, "results": results}
+
+
+# ==========================================================
+# BASELINE COMPARISON
+# ==========================================================
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD,
+            min_delta=DEFAULT_MIN_DELTA):
+    """
+    Match results by (stage, size) and return rows with the best-time
+    ratio current / baseline; "regression" is set when the ratio exceeds
+    1 + threshold and the slowdown is at least min_delta seconds.
+    """
+    base = {(r["stage"], r["size"]): r for r in baseline["results"]}
+    rows = []
+    for r in current["results"]:
+        b = base.get((r["stage"], r["size"]))
+        if b is None:
+            continue
+        ratio = r["best_s"] / b["best_s"] if b["best_s"] > 0 else float("inf")
+        rows.append({"stage": r["stage"], "size": r["size"],
+                     "baseline_s": b["best_s"], "current_s": r["best_s"],
+                     "ratio": ratio,
+                     "regression": (ratio > 1.0 + threshold and
+                                    r["best_s"] - b["best_s"] >= min_delta)})
+    return rows
+
+
+def print_comparison(rows, threshold=DEFAULT_THRESHOLD):
+    print(f"\n{'stage':<42}{'size':>6}{'base ms':>12}{'now ms':>12}"
+          f"{'ratio':>8}")
+    for r in rows:
+        flag = "  REGRESSION" if r["regression"] else ""
+        print(f"{r['stage']:<42}{r['size']:>6}{r['baseline_s'] * 1e3:>12.3f}"
+              f"{r['current_s'] * 1e3:>12.3f}{r['ratio']:>8.2f}{flag}")
+    n_bad = sum(r["regression"] for r in rows)
+    print(f"\n{n_bad} regression(s) beyond +{threshold:.0%} "
+          f"in {len(rows)} comparable result(s)")
+    return n_bad
+
+
+# ==========================================================
+# COMMAND LINE
+# ==========================================================
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m modules.benchmark",
+        description="Benchmark the pipeline stages on synthetic images."
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES),
+                        help="square image sides (powers of two)")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES),
+                        choices=STAGES, metavar="STAGE")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="keep repeating a stage until this many seconds")
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--results",
+                        help="load a JSON report instead of running")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="flag regressions against this JSON report")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown before flagging (0.10 = 10%%)")
+    parser.add_argument("--min-delta", type=float, default=DEFAULT_MIN_DELTA,
+                        help="ignore slowdowns below this many seconds")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.results:
+        with open(args.results) as f:
+            report = json.load(f)
+    else:
+        for n in args.sizes:
+            if n < 2 or n & (n - 1):
+                raise SystemExit(f"size {n} is not a power of two")
+        report = run_benchmarks(args.sizes, args.stages,
+                                args.repeat, args.min_time)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[SAVED] {args.out}")
+    elif not args.compare:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare(baseline, report, args.threshold, args.min_delta)
+        if print_comparison(rows, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
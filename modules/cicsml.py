@@ -1,6 +1,7 @@
 import hashlib
 import numpy as np
 import config
+from modules import instrument
 
 
 
@@ -37,6 +38,66 @@ def logistic_sine_map(x, a, p):
     return x_next
 
 
+def _chebyshev_sequence(p0, b, n):
+    """
+    p_1..p_n of the Chebyshev recurrence, with the lattice coefficients
+    of every step: returns an (n, 2, 1) array of (1 - p_t, p_t / 2).
+    The recurrence itself is scalar; only the coefficients vectorize.
+    """
+    p_seq = np.empty(n, dtype=np.float64)
+    p = p0
+    for t in range(n):
+        p = chebyshev_map(p, b)
+        p_seq[t] = p
+
+    coef = np.empty((n, 2, 1), dtype=np.float64)
+    np.subtract(1.0, p_seq, out=coef[:, 0, 0])
+    np.divide(p_seq, 2.0, out=coef[:, 1, 0])
+    return coef
+
+
+def _run_lattice(x, g_coef, coef, seq):
+    """
+    Iterate logistic_sine_map from x, writing step t into seq[t] with
+    coefficients coef[t] (see _chebyshev_sequence).
+
+    The steps are sequential, so the per-step cost is the ufunc calls:
+    g is computed inside a buffer padded with its periodic neighbours
+    and scaled together with the neighbour sums, which keeps it to seven
+    calls on nine values. Same operations, in the same order, as
+    logistic_sine_map, so the values are bit-identical.
+    """
+    N = seq.shape[1]
+    # row 0: g(x) between copies of its wrap-around neighbours
+    # row 1: g(x(i+1)) + g(x(i-1))
+    buf = np.zeros((2, N + 2), dtype=np.float64)
+    flat = buf.reshape(-1)
+    g = buf[0, 1:N + 1]
+    nb = buf[1, 1:N + 1]
+    terms = buf[:, 1:N + 1]
+    left = buf[0, 2:]
+    right = buf[0, :N]
+    # constants as arrays: a Python float operand is converted on every call
+    pi = np.full(N, np.pi)
+    g_coef = np.full(N, g_coef)
+    one = np.ones(N)
+
+    multiply, add, sin, mod = np.multiply, np.add, np.sin, np.mod
+    for out, c in zip(seq, coef):
+        multiply(x, pi, g)
+        sin(g, g)
+        multiply(g, g_coef, g)
+        flat[0] = flat[N]
+        flat[N + 1] = flat[1]
+        add(left, right, nb)
+
+        multiply(terms, c, terms)
+        add(g, nb, out)
+        mod(out, one, out)
+        x = out
+    return seq
+
+
 def cicsml_generate(length, a=None, b=None, p0=None, x0=None):
     """
     Generate chaotic sequence using the CICSML system, like CICSMLSystem(Key, M×N). [page:6]
@@ -45,6 +106,9 @@ def cicsml_generate(length, a=None, b=None, p0=None, x0=None):
     - N_lattice = 9 (number of lattices). [page:6]
     - a, b, p0, x0 come from the key-derivation step (see below).
     - We ignore x0 vector detail here and derive initial x(i) from x0.
+
+    Each lattice step is written straight into a preallocated float64
+    buffer (time × space), so no Python list of floats is built.
     """
 
     # If a, b, p0, x0 are not passed, use config (or they can be set from key)
@@ -64,20 +128,19 @@ def cicsml_generate(length, a=None, b=None, p0=None, x0=None):
     # create 9 initial states from x0 (simple spread, paper uses x1(i) from key)
     x = (float(x0) + 0.001 * np.arange(N_lattice)) % 1.0
 
-    seq = []
+    g_coef = 4.0 / (a - 0.5)
 
-    # Remove transient effect (T can be set in config, e.g., 100–1000)
-    for _ in range(config.TRANSIENT_ITER):
-        p = chebyshev_map(p, b)
-        x = logistic_sine_map(x, a, p)
+    # Remove transient effect (T can be set in config, e.g., 100–1000):
+    # the first T steps run into rows that are dropped afterwards
+    T = config.TRANSIENT_ITER
+    steps = -(-int(length) // N_lattice)
+    coef = _chebyshev_sequence(p, b, T + steps)
 
     # Generate sequence: flatten time × space
-    while len(seq) < length:
-        p = chebyshev_map(p, b)
-        x = logistic_sine_map(x, a, p)
-        seq.extend(x.tolist())
+    seq = np.empty((T + steps, N_lattice), dtype=np.float64)
+    _run_lattice(x, g_coef, coef, seq)
 
-    return np.array(seq[:length])
+    return seq[T:].reshape(-1)[:length]
 
 
 # ---------------------------------------------------
@@ -127,7 +190,7 @@ def derive_initial_conditions_from_key(user_key):
     return a, b, x0, p0
 
 
-def generate_chaos_with_key(user_key, length):
+def generate_chaos_with_key(user_key, length, generate=None):
     """
     FINAL FUNCTION USED BY ENCRYPTION & DECRYPTION
 
@@ -135,17 +198,24 @@ def generate_chaos_with_key(user_key, length):
     - Build a 384-bit key via SHA-384.
     - Derive (a, b, x0, p0).
     - Run CICSML to get 'length' chaotic values.
-    """
 
-    a, b, x0, p0 = derive_initial_conditions_from_key(user_key)
-
-    seq = cicsml_generate(
-        length=length,
-        a=a,
-        b=b,
-        p0=p0,
-        x0=x0
-    )
+    generate replaces cicsml_generate (same signature), e.g. to run
+    another engine's implementation.
+    """
+    if generate is None:
+        generate = cicsml_generate
+
+    with instrument.stage("key_derivation"):
+        a, b, x0, p0 = derive_initial_conditions_from_key(user_key)
+
+    with instrument.stage("chaos"):
+        seq = generate(
+            length=length,
+            a=a,
+            b=b,
+            p0=p0,
+            x0=x0
+        )
 
     return seq
 
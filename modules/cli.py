@@ -0,0 +1,267 @@
+import argparse
+import functools
+import os
+import sys
+import time
+import config
+from modules import image_utils
+from modules import encryption
+from modules import batch
+from modules import container
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+CIPHER_EXTENSION = ".miec"
+
+
+# ==========================================================
+# HELPERS
+# ==========================================================
+
+def read_key_file(path):
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8").rstrip("\r\n")
+
+
+def list_images(directory, extensions=IMAGE_EXTENSIONS):
+    names = sorted(n for n in os.listdir(directory)
+                   if n.lower().endswith(extensions))
+    return [os.path.join(directory, n) for n in names]
+
+
+def group_triples(paths):
+    """
+    Group sorted input paths into consecutive triples; leftovers are returned
+    separately so the caller can report them.
+    """
+    full = len(paths) - len(paths) % 3
+    triples = [tuple(paths[i:i + 3]) for i in range(0, full, 3)]
+    return triples, paths[full:]
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def triple_name(paths):
+    return "__".join(_stem(p) for p in paths)
+
+
+def source_names(cipher_path):
+    """
+    Names of the three source images, recovered from the cipher file name.
+    """
+    stem = _stem(cipher_path)
+    names = stem.split("__")
+    if len(names) != 3:
+        names = [f"{stem}_{i}" for i in range(1, 4)]
+    return names
+
+
+# ==========================================================
+# WORKER JOBS
+# ==========================================================
+
+def _guarded_job(job, item):
+    """
+    Run job(item), turning a failure into an (item, message) result so
+    one bad file does not stop the rest of the batch.
+    """
+    try:
+        return job(item)
+    except Exception as exc:
+        return item, str(exc) or type(exc).__name__
+
+def _encrypt_files_job(job):
+    paths, cipher_path, native, quantizer, images = job
+    start = time.perf_counter()
+
+    # images are None unless they were prefetched (see _prefetched)
+    if images is None:
+        size = None if native else config.IMAGE_SIZE
+        images = image_utils.load_images(paths, size)
+
+    indexed, palettes = [], []
+    nbytes = 0
+    for img in images:
+        nbytes += img.nbytes
+        index_matrix, palette = image_utils.indexed_image_conversion(
+            img, quantizer
+        )
+        indexed.append(index_matrix)
+        palettes.append(palette)
+
+    if not (indexed[0].shape == indexed[1].shape == indexed[2].shape):
+        raise ValueError("images of a triple differ in size")
+    ks = batch.worker_schedule(*indexed[0].shape)
+    C = encryption.encrypt_three_images(
+        *indexed, ks, workspace=batch.worker_workspace(*indexed[0].shape)
+    )
+
+    container.write_container(cipher_path, C, palettes)
+
+    return cipher_path, 3, nbytes, time.perf_counter() - start
+
+
+def _decrypt_files_job(job):
+    cipher_path, out_paths = job
+    start = time.perf_counter()
+
+    header = container.read_header(cipher_path)
+    if header["tile"]:
+        key = batch.worker_key()
+    else:
+        key = batch.worker_schedule(header["H"], header["W"])
+    decrypted = container.decrypt_container(cipher_path, key)
+
+    nbytes = 0
+    for img, path in zip(decrypted, out_paths):
+        image_utils.write_image(img, path)
+        nbytes += img.nbytes
+
+    return cipher_path, 3, nbytes, time.perf_counter() - start
+
+
+# ==========================================================
+# COMMANDS
+# ==========================================================
+
+def _job_name(item):
+    # the cipher path: second in an encrypt job, first in a decrypt job
+    return item[1] if isinstance(item[0], tuple) else item[0]
+
+
+def _run_jobs(job, jobs, args):
+    """
+    Run the jobs, reporting failed ones on stderr without stopping the
+    batch. Returns the process exit status: 1 if any job failed.
+    """
+    user_key = read_key_file(args.key_file)
+    total_images = total_bytes = 0
+    failed = 0
+
+    start = time.perf_counter()
+    for result in batch.map_with_key(
+            functools.partial(_guarded_job, job), jobs, user_key,
+            workers=args.jobs, store_root=args.schedule_store):
+        if len(result) == 2:
+            item, message = result
+            print(f"[ERROR] {_job_name(item)}: {message}", file=sys.stderr)
+            failed += 1
+            continue
+        name, n_images, nbytes, elapsed = result
+        total_images += n_images
+        total_bytes += nbytes
+        print(f"{name}: {elapsed:.3f} s, "
+              f"{nbytes / 1e6 / max(elapsed, 1e-9):.2f} MB/s")
+    wall = time.perf_counter() - start
+
+    if total_images:
+        print(f"[DONE] {total_images} images, {total_bytes / 1e6:.2f} MB "
+              f"in {wall:.3f} s: {total_images / wall:.2f} images/s, "
+              f"{total_bytes / 1e6 / wall:.2f} MB/s")
+    else:
+        print("[DONE] nothing to do")
+
+    if failed:
+        print(f"[ERROR] {failed} job(s) failed", file=sys.stderr)
+        return 1
+    return 0
+
+
+def _try_load_image(path, size):
+    try:
+        return image_utils.load_image(path, size)
+    except Exception:
+        return None
+
+
+def _prefetched(jobs, size):
+    """
+    Encrypt jobs with their images attached, the next triple decoding on
+    threads while the current one encrypts. Only used in-process: with a
+    pool, workers decode their own triples and already overlap. A triple
+    that fails to decode is left unattached, so the job loads it again
+    and reports the error itself.
+    """
+    loaded = image_utils.prefetch_triples([job[0] for job in jobs], size,
+                                          loader=_try_load_image)
+    for job, (_, images) in zip(jobs, loaded):
+        if any(img is None for img in images):
+            images = None
+        yield job[:4] + (images,)
+
+
+def cmd_encrypt(args):
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    triples, leftover = group_triples(list_images(args.in_dir))
+    for path in leftover:
+        print(f"[WARN] {path}: not part of a full triple, skipped")
+
+    jobs = []
+    for paths in triples:
+        cipher_path = os.path.join(args.out_dir,
+                                   triple_name(paths) + CIPHER_EXTENSION)
+        if os.path.exists(cipher_path):
+            print(f"[SKIP] {cipher_path}")
+            continue
+        jobs.append((paths, cipher_path, args.native, args.quantizer, None))
+
+    if args.jobs <= 1:
+        jobs = _prefetched(jobs, None if args.native else config.IMAGE_SIZE)
+    return _run_jobs(_encrypt_files_job, jobs, args)
+
+
+def cmd_decrypt(args):
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    jobs = []
+    for cipher_path in list_images(args.in_dir, (CIPHER_EXTENSION,)):
+        out_paths = [os.path.join(args.out_dir, f"{n}.png")
+                     for n in source_names(cipher_path)]
+        if all(os.path.exists(p) for p in out_paths):
+            print(f"[SKIP] {cipher_path}")
+            continue
+        jobs.append((cipher_path, out_paths))
+
+    return _run_jobs(_decrypt_files_job, jobs, args)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m modules",
+        description="Bulk multi-image encryption / decryption."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for name, func, help_text in [
+        ("encrypt", cmd_encrypt, "encrypt images from --in, three at a time"),
+        ("decrypt", cmd_decrypt, "decrypt ciphers written by 'encrypt'"),
+    ]:
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--in", dest="in_dir", required=True)
+        p.add_argument("--out", dest="out_dir", required=True)
+        p.add_argument("--key-file", required=True)
+        p.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+        p.add_argument("--schedule-store", default=None,
+                       help="directory of a persistent key schedule store")
+        if name == "encrypt":
+            p.add_argument("--native", action="store_true",
+                           help="keep native resolution instead of "
+                                "resizing to config.IMAGE_SIZE")
+            p.add_argument("--quantizer", default=None,
+                           choices=image_utils.QUANTIZERS[:-1],
+                           help="colour quantizer (default config.QUANTIZER)")
+        p.set_defaults(func=func)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import os
+import struct
+import numpy as np
+from modules import decryption
+from modules import image_utils
+from modules import tiled
+
+
+# ==========================================================
+# CIPHER CONTAINER LAYOUT
+# ==========================================================
+#
+#   offset 0     header (HEADER_SIZE bytes, little endian)
+#                  magic "MIEC", version u16, reserved u16,
+#                  H, W, tile, Hp, Wp, data_offset (u32 each)
+#   offset 64    three palettes, 768 bytes each (RGB × 256)
+#   data_offset  cipher planes R, G, B as uint8 (3, Hp, Wp), C order,
+#                aligned to DATA_ALIGN so the reader can np.memmap it
+#
+# tile == 0 means the cipher was produced by encrypt_three_images;
+# otherwise by tiled.encrypt_tiled with that tile size, and Hp × Wp is
+# the padded size.
+
+MAGIC = b"MIEC"
+VERSION = 1
+HEADER_FORMAT = "<4sHHIIIIII"
+HEADER_SIZE = 64
+PALETTE_BYTES = 768
+DATA_ALIGN = 4096
+
+
+def _data_offset():
+    end = HEADER_SIZE + 3 * PALETTE_BYTES
+    return -(-end // DATA_ALIGN) * DATA_ALIGN
+
+
+def palette_bytes(palette):
+    """
+    A palette as its fixed 768-byte on-disk / wire form: flattened,
+    truncated or zero-padded to 256 RGB entries.
+    """
+    p = np.zeros(PALETTE_BYTES, dtype=np.uint8)
+    values = np.ravel(np.asarray(palette, dtype=np.uint8))[:PALETTE_BYTES]
+    p[:values.size] = values
+    return p.tobytes()
+
+
+def create_container(path, H, W, palettes, tile=0):
+    """
+    Write header and palettes and return a writable memmap of the
+    (3, Hp, Wp) cipher planes, to be filled in place.
+    """
+    Hp, Wp = tiled.padded_shape(H, W, tile) if tile else (H, W)
+    offset = _data_offset()
+
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, 0,
+                         H, W, tile, Hp, Wp, offset)
+    with open(path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        for palette in palettes:
+            f.write(palette_bytes(palette))
+        f.truncate(offset + 3 * Hp * Wp)
+
+    return np.memmap(path, dtype=np.uint8, mode="r+",
+                     offset=offset, shape=(3, Hp, Wp))
+
+
+def write_container(path, C, palettes, H=None, W=None, tile=0):
+    """
+    Save an (Hp, Wp, 3) cipher with its three palettes. H, W default to
+    the cipher size (pass the unpadded size for tiled ciphers).
+    The file is written next to path and renamed into place.
+    """
+    if H is None:
+        H = C.shape[0]
+    if W is None:
+        W = C.shape[1]
+
+    tmp = path + ".tmp"
+    planes = create_container(tmp, H, W, palettes, tile)
+    planes[:] = np.moveaxis(C, -1, 0)
+    planes.flush()
+    del planes
+    os.replace(tmp, path)
+    return path
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE:
+        raise ValueError(f"Not a cipher container: {path}")
+
+    (magic, version, _, H, W, tile,
+     Hp, Wp, offset) = struct.unpack_from(HEADER_FORMAT, raw)
+    if magic != MAGIC:
+        raise ValueError(f"Not a cipher container: {path}")
+    if version != VERSION:
+        raise ValueError(f"Unsupported container version {version}: {path}")
+
+    return {"version": version, "H": H, "W": W, "tile": tile,
+            "Hp": Hp, "Wp": Wp, "data_offset": offset}
+
+
+def open_container(path, mode="r"):
+    """
+    Return (header, palettes, C) where C is an (Hp, Wp, 3) view of the
+    memory-mapped planes (no copy) and palettes are three 768-int lists.
+    """
+    header = read_header(path)
+
+    pal = np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER_SIZE,
+                    shape=(3, PALETTE_BYTES))
+    palettes = [pal[i].tolist() for i in range(3)]
+    del pal
+
+    planes = np.memmap(path, dtype=np.uint8, mode=mode,
+                       offset=header["data_offset"],
+                       shape=(3, header["Hp"], header["Wp"]))
+    return header, palettes, np.moveaxis(planes, 0, -1)
+
+
+def decrypt_container(path, user_key):
+    """
+    Decrypt a container straight from disk; returns the three RGB images.
+    user_key may be a KeySchedule only for untiled containers.
+    """
+    header, palettes, C = open_container(path)
+
+    if header["tile"] == 0:
+        return decryption.decrypt_three_images(C, user_key, *palettes)
+
+    if not isinstance(user_key, str):
+        raise ValueError("Tiled containers need the key string, not a "
+                         f"{type(user_key).__name__}")
+    H, W = header["H"], header["W"]
+    planes = [np.zeros((H, W), dtype=np.uint8) for _ in range(3)]
+    tiled.decrypt_tiled(C, user_key, *planes, tile=header["tile"])
+    return tuple(image_utils.indexed_to_rgb(I, MAP)
+                 for I, MAP in zip(planes, palettes))
@@ -1,167 +1,275 @@
 import numpy as np
-import hashlib
-from modules import hilbert
-from modules import fractal
-from modules import cicsml
+from modules import engines
+from modules import instrument
+from modules.key_schedule import resolve_key_schedule, scale_chaos
 from modules import image_utils
+from modules.workspace import as_output, resolve_workspace
+
+
+def _reverse_chain(T, D_taps, D0, d7_const, d8_const, T_lag2=None, out=None):
+    """
+    Undo one three-tap XOR chain of the form
+        T[n] = V[n] ^ T_lag2[n-2] ^ T[n-1] ^ D_taps[n]     (n >= 2)
+    with the n = 0 / n = 1 seeds used by the encryptor.
+    Every output depends only on the (known) chain values, so all
+    positions are computed at once. out must not alias T.
+    """
+    if T_lag2 is None:
+        T_lag2 = T
+
+    L = T.size
+    V = np.empty(L, dtype=np.uint8) if out is None else out
+
+    if L > 0:
+        V[0] = T[0] ^ d7_const ^ d8_const ^ D0
+    if L > 1:
+        V[1] = T[1] ^ d7_const ^ T[0] ^ D0
+    if L > 2:
+        np.bitwise_xor(T[2:], T_lag2[:-2], out=V[2:])
+        V[2:] ^= T[1:-1]
+        V[2:] ^= D_taps[2:]
+    return V
+
+
+def _unpermute(V_perm, IC, out=None):
+    """
+    Inverse of V_perm[n] = V[IC[n]], as a single scatter.
+    """
+    V = np.zeros(V_perm.size, dtype=np.uint8) if out is None else out
+    V[IC] = V_perm
+    return V
+
+
+def _decrypt_planes(CR_mat, CG_mat, CB_mat, IC1, IC2, Fmat, keystreams, ws):
+    """
+    Run both inverse stages; the recovered planes are left, flattened
+    column-major, in ws.V.
+    """
+    L = ws.L
 
+    IC1 = np.asarray(IC1, dtype=np.int64)
+    IC2 = np.asarray(IC2, dtype=np.int64)
 
-def derive_key_parts(user_key: str):
-    key_bytes = hashlib.sha384(user_key.encode()).digest()
-    Keys = []
-    for i in range(12):
-        seg = key_bytes[4 * i:4 * (i + 1)]
-        Keys.append(int.from_bytes(seg, "big", signed=False))
-    return Keys
+    # Prepare chaotic sequences
+    with instrument.stage("scaling"):
+        D1, D2, D3, D4, D5, D6, D7, D8 = (scale_chaos(D, L)
+                                          for D in keystreams)
 
-def scale_chaos(D, L):
-    D = np.asarray(D[:L], dtype=np.float64)
-    D = np.mod(np.floor(D * 1e14), 256)
-    return D.astype(np.uint8)
- 
-def generate_chaos_sequences(user_key, length):
-    chaos = cicsml.generate_chaos_with_key(user_key, length=8 * length)
+    d7_const = D7[L - 1]
+    d8_const = D8[L - 1]
 
-    if isinstance(chaos, tuple) and len(chaos) == 8:
-        return chaos
+    # ---------- REVERSE SECOND STAGE ----------
+    # then undo the IC2 permutation into ws.T
+    with instrument.stage("diffusion_stage2"):
+        k_all = ws.fill_k_all(Fmat)
+
+        for C_mat, D, T in ((CR_mat, D2, ws.T[0]),
+                            (CG_mat, D4, ws.T[1]),
+                            (CB_mat, D6, ws.T[2])):
+            ws.flatten(C_mat, ws.plane)   # flatten column-first
+            np.take(D, k_all, out=ws.tap)
+            _reverse_chain(ws.plane, ws.tap, D[0], d7_const, d8_const,
+                           out=ws.gather)
+            _unpermute(ws.gather, IC2, out=T)
 
-    chaos = np.asarray(chaos).flatten()
-    return np.split(chaos, 8)
+    # ---------- REVERSE FIRST STAGE ----------
+    # stage one uses D[n-1] at position n; then undo IC1 into ws.V
+    with instrument.stage("diffusion_stage1"):
+        TR = ws.T[0]
+        for ch, D in enumerate((D1, D3, D5)):
+            _reverse_chain(ws.T[ch], ws.shift_taps(D), D[0],
+                           d7_const, d8_const,
+                           T_lag2=TR if ch == 1 else None, out=ws.gather)
+            _unpermute(ws.gather, IC1, out=ws.V[ch])
 
+    return ws.V
 
 
 def synchronized_disorder_diffusion_decrypt(CR_mat, CG_mat, CB_mat,
                                             IC1, IC2, Fmat,
-                                            D1, D2, D3, D4, D5, D6, D7, D8):
-
+                                            D1, D2, D3, D4, D5, D6, D7, D8,
+                                            out=None, workspace=None):
+    """
+    Inverse of synchronized_disorder_diffusion. out, if given, is a
+    (3, M, N) uint8 array for the three index planes; workspace is a
+    DiffusionWorkspace for M×N. Returns the planes as views of out.
+    """
     M, N = CR_mat.shape
-    L = M * N
+    ws = resolve_workspace(workspace, M, N)
+    out = as_output(out, (3, M, N))
 
-    # Flatten column-first
-    CR = CR_mat.reshape(-1, order='F').astype(np.uint8)
-    CG = CG_mat.reshape(-1, order='F').astype(np.uint8)
-    CB = CB_mat.reshape(-1, order='F').astype(np.uint8)
+    V = _decrypt_planes(CR_mat, CG_mat, CB_mat, IC1, IC2, Fmat,
+                        (D1, D2, D3, D4, D5, D6, D7, D8), ws)
 
-    IC1 = np.asarray(IC1, dtype=np.int64)
-    IC2 = np.asarray(IC2, dtype=np.int64)
+    # Reshape back
+    np.copyto(out, ws.planes(V))
+    return out[0], out[1], out[2]
 
-    # Prepare chaotic sequences
-    D1 = scale_chaos(D1, L)
-    D2 = scale_chaos(D2, L)
-    D3 = scale_chaos(D3, L)
-    D4 = scale_chaos(D4, L)
-    D5 = scale_chaos(D5, L)
-    D6 = scale_chaos(D6, L)
-    D7 = scale_chaos(D7, L)
-    D8 = scale_chaos(D8, L)
 
-    d7_const = D7[L - 1]
-    d8_const = D8[L - 1]
-    print("D1 unique (dec):", np.unique(D1))
-    # ---------- REVERSE SECOND STAGE ----------
-    TR_perm = np.zeros(L, dtype=np.uint8)
-    TG_perm = np.zeros(L, dtype=np.uint8)
-    TB_perm = np.zeros(L, dtype=np.uint8)
 
-    # F matrix
-    F = np.asarray(Fmat, dtype=np.int64)
-    a, b = F[0]
-    c, d = F[1]
+def decrypt_three_images(C, user_key, MAP1, MAP2, MAP3, out=None,
+                         workspace=None, engine=None):
+    """
+    user_key may be the key string or a KeySchedule built for C.shape[:2].
+    out, if given, is a (3, H, W, 3) uint8 array receiving the three RGB
+    images; workspace is a DiffusionWorkspace for H×W. engine as in
+    encryption.encrypt_three_images.
+    """
 
-    mod_val = max(L - 1, 1)
-    idxs = np.arange(L, dtype=np.int64)
-    k_all = (c * idxs + d) % mod_val
+    H, W = C.shape[0], C.shape[1]
 
-    for n in range(L):
+    eng = engines.get_engine(engine, H, W)
+    ks = resolve_key_schedule(user_key, H, W, eng)
 
-        if n == 0:
-            TR_perm[n] = CR[n] ^ d7_const ^ d8_const ^ D2[0]
-            TG_perm[n] = CG[n] ^ d7_const ^ d8_const ^ D4[0]
-            TB_perm[n] = CB[n] ^ d7_const ^ d8_const ^ D6[0]
+    planes = eng.decrypt_planes(C, ks, workspace)
 
-        elif n == 1:
-            TR_perm[n] = CR[n] ^ d7_const ^ CR[n - 1] ^ D2[0]
-            TG_perm[n] = CG[n] ^ d7_const ^ CG[n - 1] ^ D4[0]
-            TB_perm[n] = CB[n] ^ d7_const ^ CB[n - 1] ^ D6[0]
+    if out is not None:
+        out = as_output(out, (3, H, W, 3))
+    with instrument.stage("palette_expansion"):
+        P1_dec, P2_dec, P3_dec = image_utils.indexed_to_rgb_batch(
+            planes, (MAP1, MAP2, MAP3), out=out
+        )
 
-        else:
-            k = k_all[n]
-            TR_perm[n] = CR[n] ^ CR[n - 2] ^ CR[n - 1] ^ D2[k]
-            TG_perm[n] = CG[n] ^ CG[n - 2] ^ CG[n - 1] ^ D4[k]
-            TB_perm[n] = CB[n] ^ CB[n - 2] ^ CB[n - 1] ^ D6[k]
+    return P1_dec, P2_dec, P3_dec
 
-    # Undo IC2 permutation
-    TR = np.zeros(L, dtype=np.uint8)
-    TG = np.zeros(L, dtype=np.uint8)
-    TB = np.zeros(L, dtype=np.uint8)
 
-    for n in range(L):
-        TR[IC2[n]] = TR_perm[n]
-        TG[IC2[n]] = TG_perm[n]
-        TB[IC2[n]] = TB_perm[n]
+# ==========================================================
+# SELECTIVE DECRYPTION
+# ==========================================================
 
-    # ---------- REVERSE FIRST STAGE ----------
-    v1_perm = np.zeros(L, dtype=np.uint8)
-    v2_perm = np.zeros(L, dtype=np.uint8)
-    v3_perm = np.zeros(L, dtype=np.uint8)
-
-    for n in range(L):
-
-        if n == 0:
-            v1_perm[n] = TR[n] ^ d7_const ^ d8_const ^ D1[0]
-            v2_perm[n] = TG[n] ^ d7_const ^ d8_const ^ D3[0]
-            v3_perm[n] = TB[n] ^ d7_const ^ d8_const ^ D5[0]
-
-        elif n == 1:
-            v1_perm[n] = TR[n] ^ d7_const ^ TR[n - 1] ^ D1[0]
-            v2_perm[n] = TG[n] ^ d7_const ^ TG[n - 1] ^ D3[0]
-            v3_perm[n] = TB[n] ^ d7_const ^ TB[n - 1] ^ D5[0]
-
-        else:
-            j = n - 1
-            v1_perm[n] = TR[n] ^ TR[n - 2] ^ TR[n - 1] ^ D1[j]
-            v2_perm[n] = TG[n] ^ TR[n - 2] ^ TG[n - 1] ^ D3[j]
-            v3_perm[n] = TB[n] ^ TB[n - 2] ^ TB[n - 1] ^ D5[j]
-
-    # Undo IC1 permutation
-    v1 = np.zeros(L, dtype=np.uint8)
-    v2 = np.zeros(L, dtype=np.uint8)
-    v3 = np.zeros(L, dtype=np.uint8)
-
-    for n in range(L):
-        v1[IC1[n]] = v1_perm[n]
-        v2[IC1[n]] = v2_perm[n]
-        v3[IC1[n]] = v3_perm[n]
+# which -> (cipher channel, stage-two keystream, stage-one keystream)
+_IMAGE_CHANNELS = {
+    1: (0, "D2", "D1"),
+    2: (1, "D4", "D3"),
+    3: (2, "D6", "D5"),
+}
 
-    # Reshape back
-    I1 = v1.reshape(M, N, order='F')
-    I2 = v2.reshape(M, N, order='F')
-    I3 = v3.reshape(M, N, order='F')
 
-    return I1, I2, I3
+def decrypt_image(C, user_key, which=1, palette=None):
+    """
+    Recover only image `which` (1, 2 or 3) from the three-image cipher.
 
+    Images 1 and 3 need just their own channel chain; image 2 also needs
+    the R chain because stage one couples TG on TR[n-2]. Returns the index
+    plane, or the RGB image when palette is given.
+    """
+    if which not in _IMAGE_CHANNELS:
+        raise ValueError(f"which must be 1, 2 or 3, got {which!r}")
 
+    H, W = C.shape[0], C.shape[1]
+    L = H * W
+    ks = resolve_key_schedule(user_key, H, W)
 
-def decrypt_three_images(C, user_key: str, MAP1, MAP2, MAP3):
+    d7_const = ks.D7[L - 1]
+    d8_const = ks.D8[L - 1]
 
+    F = np.asarray(ks.Fmat, dtype=np.int64)
+    c, d = F[1]
+    idxs = np.arange(L, dtype=np.int64)
+    k_all = (c * idxs + d) % max(L - 1, 1)
+    j_all = np.maximum(idxs - 1, 0)
+
+    def reverse_stage_two(channel, D):
+        CX = C[:, :, channel].reshape(-1, order='F').astype(np.uint8)
+        T_perm = _reverse_chain(CX, D[k_all], D[0], d7_const, d8_const)
+        return _unpermute(T_perm, ks.IC2)
+
+    channel, d_stage2, d_stage1 = _IMAGE_CHANNELS[which]
+    T = reverse_stage_two(channel, getattr(ks, d_stage2))
+    TR = reverse_stage_two(0, ks.D2) if which == 2 else None
+
+    D = getattr(ks, d_stage1)
+    v_perm = _reverse_chain(T, D[j_all], D[0], d7_const, d8_const,
+                            T_lag2=TR)
+    I = _unpermute(v_perm, ks.IC1).reshape(H, W, order='F')
+
+    if palette is None:
+        return I
+    with instrument.stage("palette_expansion"):
+        return image_utils.indexed_to_rgb(I, palette)
+
+
+# ==========================================================
+# REGION-OF-INTEREST DECRYPTION
+# ==========================================================
+
+def _chain_at(value_at, n, tap_at, D0, d7_const, d8_const, lag2_at=None):
+    """
+    Random-access form of _reverse_chain: the inverse chain evaluated at
+    positions n only, reading the chain through value_at(positions).
+    """
+    if lag2_at is None:
+        lag2_at = value_at
+
+    cur = value_at(n)
+    prev = value_at(np.maximum(n - 1, 0))
+
+    out = cur ^ lag2_at(np.maximum(n - 2, 0)) ^ prev ^ tap_at(n)
+    out = np.where(n == 1, cur ^ d7_const ^ prev ^ D0, out)
+    out = np.where(n == 0, cur ^ d7_const ^ d8_const ^ D0, out)
+    return out.astype(np.uint8)
+
+
+def decrypt_region(C, user_key, y0, x0, h, w, which=(1, 2, 3),
+                   palettes=None):
+    """
+    Decrypt only the h×w rectangle at (y0, x0) of the images in `which`.
+
+    Each plaintext pixel needs three stage-one chain values, and each of
+    those three cipher values, so only O(h*w) cipher positions are read
+    (C may be a memmap, e.g. from container.open_container). The inverse
+    IC1 / IC2 tables are cached on the key schedule, so pass a
+    KeySchedule when decrypting many regions.
+
+    Returns a tuple of (h, w) index planes, or RGB images when palettes
+    (one per image in `which`) are given.
+    """
     H, W = C.shape[0], C.shape[1]
+    if not (0 <= y0 and 0 <= x0 and h > 0 and w > 0
+            and y0 + h <= H and x0 + w <= W):
+        raise ValueError(f"Region {h}x{w} at ({y0}, {x0}) outside {H}x{W}")
 
-    Keys = derive_key_parts(user_key)
-    FM, IC1, IC2, Fmat = fractal.build_fractal_matrix(H, W, Keys)
-    D1, D2, D3, D4, D5, D6, D7, D8 = generate_chaos_sequences(user_key, H * W)
-
-    CR = C[:, :, 0].astype(np.uint8)
-    CG = C[:, :, 1].astype(np.uint8)
-    CB = C[:, :, 2].astype(np.uint8)
+    L = H * W
+    ks = resolve_key_schedule(user_key, H, W)
+    inv1 = ks.inverse_IC1()
+    inv2 = ks.inverse_IC2()
 
-    I1_idx, I2_idx, I3_idx = synchronized_disorder_diffusion_decrypt(
-        CR, CG, CB,
-        IC1, IC2, Fmat,
-        D1, D2, D3, D4, D5, D6, D7, D8
-    )
+    d7_const = ks.D7[L - 1]
+    d8_const = ks.D8[L - 1]
 
-    P1_dec = image_utils.indexed_to_rgb(I1_idx, MAP1)
-    P2_dec = image_utils.indexed_to_rgb(I2_idx, MAP2)
-    P3_dec = image_utils.indexed_to_rgb(I3_idx, MAP3)
+    F = np.asarray(ks.Fmat, dtype=np.int64)
+    c, d = F[1]
+    mod_val = max(L - 1, 1)
 
-    return P1_dec, P2_dec, P3_dec
+    def stage_two_at(channel, D):
+        # plane T (after undoing IC2) at positions m
+        def cipher_at(n):
+            return C[n % H, n // H, channel]
+
+        def tap_at(n):
+            return D[(c * n + d) % mod_val]
+
+        return lambda m: _chain_at(cipher_at, inv2[m], tap_at, D[0],
+                                   d7_const, d8_const)
+
+    # column-major positions of the region
+    rows, cols = np.mgrid[y0:y0 + h, x0:x0 + w]
+    n1 = inv1[cols * H + rows]
+
+    TR_at = stage_two_at(0, ks.D2)
+    results = []
+    for i in which:
+        channel, d_stage2, d_stage1 = _IMAGE_CHANNELS[i]
+        T_at = TR_at if i == 1 else stage_two_at(channel,
+                                                 getattr(ks, d_stage2))
+        D = getattr(ks, d_stage1)
+        I = _chain_at(T_at, n1, lambda n: D[np.maximum(n - 1, 0)], D[0],
+                      d7_const, d8_const,
+                      lag2_at=TR_at if i == 2 else None)
+        results.append(I)
+
+    if palettes is not None:
+        with instrument.stage("palette_expansion"):
+            results = [image_utils.indexed_to_rgb(I, MAP)
+                       for I, MAP in zip(results, palettes)]
+    return tuple(results)
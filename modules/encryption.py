@@ -1,146 +1,146 @@
 import numpy as np
-import hashlib
-from modules import hilbert
-from modules import fractal
-from modules import cicsml
-
-
-
-
-def derive_key_parts(user_key: str):
-    key_bytes = hashlib.sha384(user_key.encode()).digest()
-    Keys = []
-    for i in range(12):
-        seg = key_bytes[4 * i:4 * (i + 1)]
-        Keys.append(int.from_bytes(seg, "big", signed=False))
-    return Keys
-
-
-
-def scale_chaos(D, L):
-    D = np.asarray(D[:L], dtype=np.float64)
-    D = np.mod(np.floor(D * 1e14), 256)
-    return D.astype(np.uint8)
-
-def generate_chaos_sequences(user_key, length):
-    chaos = cicsml.generate_chaos_with_key(user_key, length=8 * length)
-
-    if isinstance(chaos, tuple) and len(chaos) == 8:
-        return chaos
-
-    chaos = np.asarray(chaos).flatten()
-    return np.split(chaos, 8)
-
+from modules import engines
+from modules import instrument
+from modules.key_schedule import resolve_key_schedule, scale_chaos
+from modules.workspace import as_output, resolve_workspace
+
+
+
+
+def _xor_scan3(U, out=None, scratch=None):
+    """
+    Solve T[n] = U[n] ^ T[n-1] ^ T[n-2] (zero history) as a prefix scan.
+
+    Over GF(2), 1 / (1 + x + x^2) = (1 + x) / (1 + x^3), so with
+    P[n] = U[n] ^ P[n-3] (an XOR prefix scan over each residue class
+    mod 3) the chain is T[n] = P[n] ^ P[n-1].
+
+    scratch, if given, has room for U.size rounded up to a multiple of 3;
+    out may be U itself.
+    """
+    L = U.size
+    pad = (-L) % 3
+
+    if scratch is None:
+        scratch = np.zeros(L + pad, dtype=np.uint8)
+    if out is None:
+        out = np.empty(L, dtype=np.uint8)
+
+    P = scratch[:L + pad]
+    P[:L] = U
+    P[L:] = 0
+    P3 = P.reshape(-1, 3)
+    np.bitwise_xor.accumulate(P3, axis=0, out=P3)
+
+    out[:1] = P[:1]
+    np.bitwise_xor(P[1:L], P[:L - 1], out=out[1:])
+    return out
+
+
+def _xor_scan1(U, out=None):
+    """
+    Solve T[n] = U[n] ^ T[n-1] (zero history) as a prefix scan.
+    """
+    return np.bitwise_xor.accumulate(U, out=out)
+
+
+def _chain_inputs(V, D_taps, D0, d7_const, d8_const, T_lag2=None):
+    """
+    Fold everything except the T[n-1] / T[n-2] feedback into V (in place),
+    so that the n = 0 and n = 1 seeds become ordinary terms of a chain
+    with zero history:
+        U[0] = V[0] ^ d7 ^ d8 ^ D0
+        U[1] = V[1] ^ d7 ^ D0
+        U[n] = V[n] ^ D_taps[n]  (^ T_lag2[n-2] for the coupled chain)
+    """
+    head = V[:2].copy()
+    V ^= D_taps
+    if V.size > 0:
+        V[0] = head[0] ^ d7_const ^ d8_const ^ D0
+    if V.size > 1:
+        V[1] = head[1] ^ d7_const ^ D0
+    if T_lag2 is not None and V.size > 2:
+        V[2:] ^= T_lag2[:-2]
+    return V
 
 
 def synchronized_disorder_diffusion(I1, I2, I3,
                                     IC1, IC2, Fmat,
-                                    D1, D2, D3, D4, D5, D6, D7, D8):
+                                    D1, D2, D3, D4, D5, D6, D7, D8,
+                                    out=None, workspace=None):
+    """
+    Two-stage diffusion of three M×N index planes.
+
+    out, if given, is an (M, N, 3) uint8 array that receives the cipher;
+    workspace is a DiffusionWorkspace for M×N whose buffers are reused.
+    Returns the three cipher planes as views of out.
+    """
     M, N = I1.shape
     L = M * N
 
-    v1 = I1.reshape(-1, order='F').astype(np.uint8)
-    v2 = I2.reshape(-1, order='F').astype(np.uint8)
-    v3 = I3.reshape(-1, order='F').astype(np.uint8)
+    ws = resolve_workspace(workspace, M, N)
+    out = as_output(out, (M, N, 3))
 
     IC1 = np.asarray(IC1, dtype=np.int64)
     IC2 = np.asarray(IC2, dtype=np.int64)
 
-    D1 = scale_chaos(D1, L)
-    D2 = scale_chaos(D2, L)
-    D3 = scale_chaos(D3, L)
-    D4 = scale_chaos(D4, L)
-    D5 = scale_chaos(D5, L)
-    D6 = scale_chaos(D6, L)
-    D7 = scale_chaos(D7, L)
-    D8 = scale_chaos(D8, L)
-    
-    d7_const = D7[L - 1]  
-    d8_const = D8[L - 1]  
-
-    print("D1 unique:", np.unique(D1))
-    print("D2 unique:", np.unique(D2))
-    print("D7 unique:", np.unique(D7))
-    TR = np.zeros(L, dtype=np.uint8)
-    TG = np.zeros(L, dtype=np.uint8)
-    TB = np.zeros(L, dtype=np.uint8)
-    
-    for n in range(L):
-        i = IC1[n]
-
-        if n == 0:
-            TR[n] = v1[i] ^ d7_const ^ d8_const ^ D1[0]
-            TG[n] = v2[i] ^ d7_const ^ d8_const ^ D3[0]
-            TB[n] = v3[i] ^ d7_const ^ d8_const ^ D5[0]
-
-        elif n == 1:
-            TR[n] = v1[i] ^ d7_const ^ TR[n - 1] ^ D1[0]
-            TG[n] = v2[i] ^ d7_const ^ TG[n - 1] ^ D3[0]
-            TB[n] = v3[i] ^ d7_const ^ TB[n - 1] ^ D5[0]
-
-        else:
-            j = n - 1        
-            
-            TR[n] = v1[i] ^ TR[n - 2] ^ TR[n - 1] ^ D1[j]
-          
-            TG[n] = v2[i] ^ TR[n - 2] ^ TG[n - 1] ^ D3[j]
-          
-            TB[n] = v3[i] ^ TB[n - 2] ^ TB[n - 1] ^ D5[j]
-
-    F = np.asarray(Fmat, dtype=np.int64)
-    a, b = F[0]
-    c, d = F[1]
-
-    mod_val = max(L - 1, 1)
-    idxs = np.arange(L, dtype=np.int64)
-
-
-    j_all = (a * idxs + b) % mod_val
-    k_all = (c * idxs + d) % mod_val
-
-    CR = np.zeros(L, dtype=np.uint8)
-    CG = np.zeros(L, dtype=np.uint8)
-    CB = np.zeros(L, dtype=np.uint8)
-
-    for n in range(L):
-        i = IC2[n]
-        j = j_all[n]
-        k = k_all[n]
-
-        if n == 0:
-            CR[n] = TR[i] ^ d7_const ^ d8_const ^ D2[0]
-            CG[n] = TG[i] ^ d7_const ^ d8_const ^ D4[0]
-            CB[n] = TB[i] ^ d7_const ^ d8_const ^ D6[0]
-
-        elif n == 1:
-            CR[n] = TR[i] ^ d7_const ^ CR[n - 1] ^ D2[0]
-            CG[n] = TG[i] ^ d7_const ^ CG[n - 1] ^ D4[0]
-            CB[n] = TB[i] ^ d7_const ^ CB[n - 1] ^ D6[0]
-
-        else:
-            CR[n] = TR[i] ^ CR[n - 2] ^ CR[n - 1] ^ D2[k]
-            CG[n] = TG[i] ^ CG[n - 2] ^ CG[n - 1] ^ D4[k]
-            CB[n] = TB[i] ^ CB[n - 2] ^ CB[n - 1] ^ D6[k]
-
-    CR_mat = CR.reshape(M, N, order='F')
-    CG_mat = CG.reshape(M, N, order='F')
-    CB_mat = CB.reshape(M, N, order='F')
-    
-    
-    return CR_mat, CG_mat, CB_mat
-
-
-def encrypt_three_images(I1, I2, I3, user_key: str):
+    with instrument.stage("scaling"):
+        D1, D2, D3, D4, D5, D6, D7, D8 = (
+            scale_chaos(D, L) for D in (D1, D2, D3, D4, D5, D6, D7, D8)
+        )
+
+    d7_const = D7[L - 1]
+    d8_const = D8[L - 1]
+
+    TR, TG, TB = ws.T
+
+    # ---------- FIRST STAGE ----------
+    # TR[n] = v1[IC1[n]] ^ TR[n-2] ^ TR[n-1] ^ D1[n-1]
+    # TG[n] = v2[IC1[n]] ^ TR[n-2] ^ TG[n-1] ^ D3[n-1]   (coupled on TR)
+    # TB[n] = v3[IC1[n]] ^ TB[n-2] ^ TB[n-1] ^ D5[n-1]
+    with instrument.stage("diffusion_stage1"):
+        for I, D, T in ((I1, D1, TR), (I2, D3, TG), (I3, D5, TB)):
+            ws.flatten(I, ws.plane)
+            np.take(ws.plane, IC1, out=ws.gather)
+            if T is TG:
+                _chain_inputs(ws.gather, ws.shift_taps(D), D[0],
+                              d7_const, d8_const, T_lag2=TR)
+                _xor_scan1(ws.gather, out=T)
+            else:
+                _chain_inputs(ws.gather, ws.shift_taps(D), D[0],
+                              d7_const, d8_const)
+                _xor_scan3(ws.gather, out=T, scratch=ws.scan)
+
+    # ---------- SECOND STAGE ----------
+    # C[n] = T[IC2[n]] ^ C[n-2] ^ C[n-1] ^ D[k_all[n]]
+    with instrument.stage("diffusion_stage2"):
+        k_all = ws.fill_k_all(Fmat)
+
+        for ch, (T, D) in enumerate(((TR, D2), (TG, D4), (TB, D6))):
+            np.take(T, IC2, out=ws.gather)
+            np.take(D, k_all, out=ws.tap)
+            _chain_inputs(ws.gather, ws.tap, D[0], d7_const, d8_const)
+            _xor_scan3(ws.gather, out=ws.V[ch], scratch=ws.scan)
+            ws.unflatten(ws.V[ch], out[:, :, ch])
+
+    return out[:, :, 0], out[:, :, 1], out[:, :, 2]
+
+
+def encrypt_three_images(I1, I2, I3, user_key, out=None, workspace=None,
+                         engine=None):
+    """
+    user_key may be the key string or a KeySchedule built for I1.shape.
+    out (an H×W×3 uint8 array, or a writable buffer of that many bytes)
+    and workspace (a DiffusionWorkspace) let repeated calls of the same
+    size reuse their buffers. engine names a modules.engines engine
+    (default config.ENGINE); all engines give identical ciphers.
+    """
     H, W = I1.shape
 
-    Keys = derive_key_parts(user_key)
-    FM, IC1, IC2, Fmat = fractal.build_fractal_matrix(H, W, Keys)
-    
-    D1, D2, D3, D4, D5, D6, D7, D8 = generate_chaos_sequences(user_key, H * W)
-
-    CR, CG, CB = synchronized_disorder_diffusion(
-        I1, I2, I3, IC1, IC2, Fmat,
-        D1, D2, D3, D4, D5, D6, D7, D8
-    )
-    C = np.stack([CR, CG, CB], axis=-1).astype(np.uint8)
-    return C
\ No newline at end of file
+    eng = engines.get_engine(engine, H, W)
+    ks = resolve_key_schedule(user_key, H, W, eng)
+
+    out = as_output(out, (H, W, 3))
+
+    eng.encrypt_planes(I1, I2, I3, ks, out, workspace)
+    return out
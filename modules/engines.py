@@ -0,0 +1,329 @@
+import argparse
+import sys
+import time
+import numpy as np
+import config
+from modules import cicsml
+from modules import decryption
+from modules import encryption
+from modules import hilbert
+from modules import reference
+from modules.key_schedule import build_key_schedule, scale_chaos
+from modules.workspace import resolve_workspace
+
+
+# ==========================================================
+# ENGINE REGISTRY
+# ==========================================================
+
+class Engine:
+    """
+    One implementation of the cipher's heavy parts:
+
+        encrypt_planes(I1, I2, I3, ks, out, workspace)  fills out (H, W, 3)
+        decrypt_planes(C, ks, workspace)                -> (3, H, W) planes
+        hilbert_indices(M, N)                           -> (M*N, 2) table
+        chaos(length, a, b, p0, x0)                     -> chaotic values
+
+    Every engine must produce the same bytes as "reference"; see
+    check_engines.
+    """
+
+    __slots__ = ("name", "encrypt_planes", "decrypt_planes",
+                 "hilbert_indices", "chaos")
+
+    def __init__(self, name, encrypt_planes, decrypt_planes,
+                 hilbert_indices, chaos):
+        self.name = name
+        self.encrypt_planes = encrypt_planes
+        self.decrypt_planes = decrypt_planes
+        self.hilbert_indices = hilbert_indices
+        self.chaos = chaos
+
+    def __repr__(self):
+        return f"Engine({self.name!r})"
+
+
+ENGINES = {}
+
+
+def register_engine(name, encrypt_planes, decrypt_planes,
+                    hilbert_indices, chaos):
+    engine = Engine(name, encrypt_planes, decrypt_planes,
+                    hilbert_indices, chaos)
+    ENGINES[name] = engine
+    return engine
+
+
+# --------- reference: the original per-pixel loops ---------
+
+def _reference_encrypt(I1, I2, I3, ks, out, workspace=None):
+    planes = reference.synchronized_disorder_diffusion(
+        I1, I2, I3, ks.IC1, ks.IC2, ks.Fmat, *ks.keystreams
+    )
+    for ch, P in enumerate(planes):
+        out[:, :, ch] = P
+    return out
+
+
+def _reference_decrypt(C, ks, workspace=None):
+    return np.stack(reference.synchronized_disorder_diffusion_decrypt(
+        C[:, :, 0], C[:, :, 1], C[:, :, 2],
+        ks.IC1, ks.IC2, ks.Fmat, *ks.keystreams
+    ))
+
+
+# --------- vectorized: XOR scans over whole planes ---------
+
+def _vectorized_encrypt(I1, I2, I3, ks, out, workspace=None):
+    encryption.synchronized_disorder_diffusion(
+        I1, I2, I3, ks.IC1, ks.IC2, ks.Fmat, *ks.keystreams,
+        out=out, workspace=workspace
+    )
+    return out
+
+
+def _vectorized_decrypt(C, ks, workspace=None):
+    ws = resolve_workspace(workspace, ks.H, ks.W)
+    V = decryption._decrypt_planes(C[:, :, 0], C[:, :, 1], C[:, :, 2],
+                                   ks.IC1, ks.IC2, ks.Fmat,
+                                   ks.keystreams, ws)
+    return ws.planes(V)
+
+
+register_engine("reference", _reference_encrypt, _reference_decrypt,
+                reference.pseudo_hilbert_indices, reference.cicsml_generate)
+register_engine("vectorized", _vectorized_encrypt, _vectorized_decrypt,
+                hilbert.generate_pseudo_hilbert_indices,
+                cicsml.cicsml_generate)
+
+
+# ==========================================================
+# AUTO SELECTION
+# ==========================================================
+
+# ((max_pixels, engine), ...) in increasing order; None = no upper bound
+_calibration = tuple(config.ENGINE_CALIBRATION)
+
+
+def set_calibration(table):
+    """
+    Install a calibration table, e.g. the result of calibrate().
+    """
+    global _calibration
+    for _, name in table:
+        if name not in ENGINES:
+            raise ValueError(f"Unknown engine {name!r} in calibration table")
+    _calibration = tuple(table)
+
+
+def get_engine(name=None, H=None, W=None):
+    """
+    Engine by name; None means config.ENGINE, and "auto" picks the
+    calibrated engine for an H×W image.
+    """
+    if name is not None and not isinstance(name, str):
+        return name   # already an Engine
+    if name is None:
+        name = config.ENGINE
+    if name == "auto":
+        pixels = H * W if H is not None and W is not None else None
+        for max_pixels, choice in _calibration:
+            if max_pixels is None or (pixels is not None
+                                      and pixels <= max_pixels):
+                return ENGINES[choice]
+        return ENGINES["vectorized"]
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Unknown engine {name!r}, expected 'auto' or one "
+                         f"of {sorted(ENGINES)}") from None
+
+
+# ==========================================================
+# DIFFERENTIAL HARNESS
+# ==========================================================
+
+HARNESS_SHAPES = ((2, 2), (8, 8), (16, 16), (8, 24), (20, 12), (32, 32))
+
+
+def _check_engine(engine, key, planes, palettes, ref):
+    """
+    Compare every component of engine with the reference results in
+    ref; returns a list of mismatch descriptions.
+    """
+    I1, I2, I3 = planes
+    H, W = I1.shape
+    L = H * W
+    errors = []
+
+    if not np.array_equal(engine.hilbert_indices(H, W), ref["hilbert"]):
+        errors.append("hilbert_indices")
+
+    a, b, x0, p0 = cicsml.derive_initial_conditions_from_key(key)
+    seq = np.asarray(engine.chaos(8 * L, a=a, b=b, p0=p0, x0=x0))
+    if not np.array_equal(seq, ref["chaos"]):
+        errors.append("chaos")
+    if not np.array_equal(scale_chaos(seq, L), reference.scale_chaos(seq, L)):
+        errors.append("scale_chaos")
+
+    ks = build_key_schedule(key, H, W, engine)
+    for field in ("IC1", "IC2", "Fmat", "D1", "D2", "D3", "D4",
+                  "D5", "D6", "D7", "D8"):
+        if not np.array_equal(getattr(ks, field), getattr(ref["ks"], field)):
+            errors.append(f"key schedule {field}")
+
+    C = encryption.encrypt_three_images(I1, I2, I3, key, engine=engine)
+    if not np.array_equal(C, ref["cipher"]):
+        errors.append("encrypt")
+
+    # index planes of a wider dtype are taken modulo 256, as .astype does
+    wide = [I.astype(np.int64) + 256 for I in planes]
+    C = encryption.encrypt_three_images(*wide, ks, engine=engine)
+    if not np.array_equal(C, ref["cipher"]):
+        errors.append("encrypt (int64 planes)")
+
+    dec = decryption.decrypt_three_images(ref["cipher"].astype(np.int32), ks,
+                                          *palettes, engine=engine)
+    if not all(np.array_equal(P, Q) for P, Q in zip(dec, ref["rgb"])):
+        errors.append("decrypt (int32 cipher)")
+
+    dec = decryption.decrypt_three_images(ref["cipher"], key, *palettes,
+                                          engine=engine)
+    if not all(np.array_equal(P, Q) for P, Q in zip(dec, ref["rgb"])):
+        errors.append("decrypt")
+    return errors
+
+
+def check_engines(names=None, trials=3, shapes=HARNESS_SHAPES, seed=0):
+    """
+    Run every engine in names (default: all registered) against the
+    reference loops on random keys and index images of each shape.
+    Returns a list of (engine, shape, key, component) mismatches; empty
+    means every engine is byte-identical to the reference.
+    """
+    if names is None:
+        names = list(ENGINES)
+    rng = np.random.default_rng(seed)
+    ref_engine = ENGINES["reference"]
+    mismatches = []
+
+    for _ in range(trials):
+        for H, W in shapes:
+            key = rng.bytes(12).hex()
+            planes = [rng.integers(0, 256, (H, W), dtype=np.uint8)
+                      for _ in range(3)]
+            palettes = [rng.integers(0, 256, 768).tolist() for _ in range(3)]
+
+            a, b, x0, p0 = cicsml.derive_initial_conditions_from_key(key)
+            ks = build_key_schedule(key, H, W, ref_engine)
+            cipher = encryption.encrypt_three_images(*planes, ks,
+                                                     engine=ref_engine)
+            ref = {
+                "hilbert": reference.pseudo_hilbert_indices(H, W),
+                "chaos": reference.cicsml_generate(8 * H * W, a=a, b=b,
+                                                   p0=p0, x0=x0),
+                "ks": ks,
+                "cipher": cipher,
+                "rgb": decryption.decrypt_three_images(cipher, ks, *palettes,
+                                                       engine=ref_engine),
+            }
+
+            # the reference round trip itself must be lossless
+            back = ref_engine.decrypt_planes(cipher, ks)
+            if not all(np.array_equal(P, I) for P, I in zip(back, planes)):
+                mismatches.append(("reference", (H, W), key, "round trip"))
+
+            for name in names:
+                if name == "reference":
+                    continue
+                for component in _check_engine(ENGINES[name], key, planes,
+                                               palettes, ref):
+                    mismatches.append((name, (H, W), key, component))
+    return mismatches
+
+
+# ==========================================================
+# CALIBRATION
+# ==========================================================
+
+CALIBRATION_SHAPES = ((4, 4), (8, 8), (16, 16), (32, 32), (64, 64))
+
+
+def _best_time(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def calibrate(names=None, shapes=CALIBRATION_SHAPES, repeat=3, seed=0):
+    """
+    Time a full encryption (key string in) with every engine that passes
+    check_engines, and return the calibration table: the fastest engine
+    up to each measured size, the last one covering everything larger.
+    """
+    if names is None:
+        names = list(ENGINES)
+    failed = {m[0] for m in check_engines(names, trials=1, seed=seed)}
+    names = [n for n in names if n not in failed]
+    if not names:
+        raise ValueError("No engine passed the differential check")
+
+    rng = np.random.default_rng(seed)
+    fastest = []
+    for H, W in shapes:
+        planes = [rng.integers(0, 256, (H, W), dtype=np.uint8)
+                  for _ in range(3)]
+        times = {
+            name: _best_time(
+                lambda: encryption.encrypt_three_images(
+                    *planes, "calibration", engine=ENGINES[name]),
+                repeat)
+            for name in names
+        }
+        fastest.append((H * W, min(times, key=times.get)))
+
+    # merge runs of the same engine; the last choice has no upper bound
+    table = []
+    for pixels, name in fastest:
+        if table and table[-1][1] == name:
+            table[-1] = (pixels, name)
+        else:
+            table.append((pixels, name))
+    table[-1] = (None, table[-1][1])
+    return table
+
+
+# ==========================================================
+# COMMAND LINE
+# ==========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m modules.engines",
+        description="Check every engine against the reference loops."
+    )
+    parser.add_argument("--trials", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--calibrate", action="store_true",
+                        help="also print a calibration table for config")
+    args = parser.parse_args(argv)
+
+    mismatches = check_engines(trials=args.trials, seed=args.seed)
+    for name, shape, key, component in mismatches:
+        print(f"[MISMATCH] {name} {shape[0]}x{shape[1]} key={key}: {component}")
+    if mismatches:
+        return 1
+    print(f"[OK] {', '.join(sorted(ENGINES))} byte-identical "
+          f"over {args.trials} trial(s) x {len(HARNESS_SHAPES)} shapes")
+
+    if args.calibrate:
+        print("ENGINE_CALIBRATION =", tuple(calibrate(seed=args.seed)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,6 @@
 import numpy as np
-import config
 from modules import hilbert
+from modules import instrument
 
 def generate_base_matrix():
     """
@@ -16,34 +16,73 @@ def generate_base_matrix():
 
 
 
-def build_fractal_matrix(M, N, Keys):
+# Quadrant multipliers of one fractal step:
+#   FM_{k+1} = [[2 * FM_k, 3 * FM_k],
+#               [4 * FM_k, 1 * FM_k]]
+QUADRANT_MULTIPLIERS = np.array([
+    [2, 3],
+    [4, 1]
+], dtype=np.float64)
+
+
+def fractal_entries(rows, cols, size):
+    """
+    Entries FM[rows, cols] of the size×size fractal matrix, computed from
+    the bit patterns of the indices instead of building the matrix:
+    bit 0 of (row, col) picks the seed value and every higher bit k picks
+    the multiplier of the level-k quadrant.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+
+    seed = generate_base_matrix().astype(np.float64)
+    vals = seed[rows & 1, cols & 1]
+
+    level = 2
+    k = 1
+    while level < size:
+        vals = vals * QUADRANT_MULTIPLIERS[(rows >> k) & 1, (cols >> k) & 1]
+        level *= 2
+        k += 1
+    return vals
+
+
+def build_fractal_matrix(M, N, Keys, hilbert_indices=None):
+    """
+    Returns (FM_vec, IC1, IC2, Fmat).
+
+    hilbert_indices(M, N) gives the traversal table used by both
+    scrambles (default hilbert.generate_pseudo_hilbert_indices).
+
+    FM_vec holds the first M*N entries of the column-major fractal matrix
+    (the only ones the ranking uses); the full size×size matrix is never
+    built, so memory and time are O(M*N).
+    """
     max_side = max(M, N)
     e = int(np.floor(np.log2(max_side))) + 1
     size = 2 ** e
-    FM = np.array([[6, 4],
-                   [2, 8]], dtype=np.float64)
-
-    while FM.shape[0] < size:
-        Fk = FM
-        FM = np.block([
-            [2 * Fk, 3 * Fk],
-            [4 * Fk, 1 * Fk]
-        ])
-
-    FM = FM[:size, :size]
 
     L = M * N
-    FM_vec = FM.reshape(-1, order='F')[:L]
+    with instrument.stage("fractal"):
+        # column-major position i -> (row, col) = (i mod size, i div size)
+        i = np.arange(L, dtype=np.int64)
+        FM_vec = fractal_entries(i & (size - 1), i >> e, size)
+        del i
 
-    A = np.argsort(-FM_vec)       
+        A = np.argsort(-FM_vec)
 
     B = A.copy()
 
     A_mat = A.reshape(M, N, order='C')
     B_mat = B.reshape(M, N, order='C')
 
-    IC1 = hilbert.hilbert_method1_scramble(A_mat)         
-    IC2 = hilbert.hilbert_method2_scramble(B_mat, A_mat)  
+    if hilbert_indices is None:
+        hilbert_indices = hilbert.generate_pseudo_hilbert_indices
+
+    with instrument.stage("hilbert"):
+        indices = hilbert_indices(M, N)
+        IC1 = hilbert.hilbert_method1_scramble(A_mat, indices)
+        IC2 = hilbert.hilbert_method2_scramble(B_mat, A_mat, indices)
 
     IC1 = np.asarray(IC1, dtype=np.int64)[:L]
     IC2 = np.asarray(IC2, dtype=np.int64)[:L]
@@ -56,10 +95,11 @@ def build_fractal_matrix(M, N, Keys):
         xs.append(xi - 1)            
         ys.append(yi - 1)
 
+    F = fractal_entries(xs, ys, size)
     Fmat = np.array([
-        [FM[xs[0], ys[0]], FM[xs[1], ys[1]]],
-        [FM[xs[2], ys[2]], FM[xs[3], ys[3]]]
+        [F[0], F[1]],
+        [F[2], F[3]]
     ], dtype=np.int64)
 
-    return FM, IC1, IC2, Fmat
+    return FM_vec, IC1, IC2, Fmat
 
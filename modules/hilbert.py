@@ -1,4 +1,7 @@
+from functools import lru_cache
+
 import numpy as np
+import config
 
 
 # --------- HILBERT CURVE CORE LOGIC ---------
@@ -30,32 +33,155 @@ def hilbert_index_to_xy(n, d):
     return x, y
 
 
+def _hilbert_table(n):
+    """
+    Vectorized form of hilbert_index_to_xy over every d in 0..n*n-1.
+    Runs the same bit-pair loop, but on whole arrays (log2(n) steps).
+    """
+    t = np.arange(n * n, dtype=np.int64)
+    x = np.zeros(n * n, dtype=np.int64)
+    y = np.zeros(n * n, dtype=np.int64)
+    s = 1
+    while s < n:
+        rx = 1 & (t >> 1)
+        ry = 1 & (t ^ rx)
+
+        # rot(s, x, y, rx, ry): flip where (rx, ry) == (1, 0), swap where ry == 0
+        flip = (ry == 0) & (rx == 1)
+        x = np.where(flip, s - 1 - x, x)
+        y = np.where(flip, s - 1 - y, y)
+        swap = ry == 0
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+
+        x += s * rx
+        y += s * ry
+        t >>= 2
+        s *= 2
+
+    indices = np.empty((n * n, 2), dtype=int)
+    indices[:, 0] = x
+    indices[:, 1] = y
+    indices.setflags(write=False)
+    return indices
+
+
+@lru_cache(maxsize=config.HILBERT_CACHE_SIZE)
 def generate_hilbert_indices(n):
     """
     Return an array of shape (n*n, 2) giving (x,y) for Hilbert indices 0..n*n-1.
+    Tables are cached per size and returned read-only.
+    """
+    return _hilbert_table(int(n))
+
+
+# --------- GENERALIZED (PSEUDO-)HILBERT CURVE ---------
+
+def _half(n, sign):
+    # floor division of the signed extent (sign * n) // 2, as a length
+    return n // 2 if sign > 0 else -(-n // 2)
+
+
+def _gilbert_uv(w, h, sa=1, sb=1, memo=None):
+    """
+    Generalized Hilbert ("gilbert") curve over a w×h block in local
+    coordinates (u along the major side of length w, v along the minor
+    side h), starting at (0, 0) and ending at (w-1, 0).
+
+    sa / sb are the signs of the major / minor direction vectors in the
+    original construction; they only decide how odd sides are halved.
+    Every sub-block is solved in its own local frame and mapped back, so
+    blocks of equal shape are computed once per top-level call (memo is
+    that call's table, dropped when it returns) and each level is a few
+    array operations. Returns a read-only (w*h, 2) array of (u, v).
+    """
+    if memo is None:
+        memo = {}
+    uv = memo.get((w, h, sa, sb))
+    if uv is not None:
+        return uv
+
+    if h == 1:
+        uv = np.stack([np.arange(w), np.zeros(w, dtype=np.int64)], axis=1)
+    elif w == 1:
+        uv = np.stack([np.zeros(h, dtype=np.int64), np.arange(h)], axis=1)
+    else:
+        w2 = _half(w, sa)
+        h2 = _half(h, sb)
+        if 2 * w > 3 * h:
+            # long case: split along the major side only
+            if (w2 % 2) and (w > 2):
+                w2 += 1
+            s1 = _gilbert_uv(w2, h, sa, sb, memo)
+            s2 = _gilbert_uv(w - w2, h, sa, sb, memo)
+            uv = np.concatenate([s1, s2 + (w2, 0)])
+        else:
+            # standard case: step up, long run across, step down
+            if (h2 % 2) and (h > 2):
+                h2 += 1
+            s1 = _gilbert_uv(h2, w2, sb, sa, memo)
+            s2 = _gilbert_uv(w, h - h2, sa, sb, memo)
+            s3 = _gilbert_uv(h2, w - w2, -sb, -sa, memo)
+            uv = np.concatenate([
+                s1[:, ::-1],
+                s2 + (0, h2),
+                (w - 1, h2 - 1) - s3[:, ::-1],
+            ])
+
+    uv = np.ascontiguousarray(uv, dtype=np.int64)
+    uv.setflags(write=False)
+    memo[(w, h, sa, sb)] = uv
+    return uv
+
+
+def _is_power_of_two(n):
+    return n > 0 and (n & (n - 1)) == 0
+
+
+@lru_cache(maxsize=config.HILBERT_CACHE_SIZE)
+def generate_pseudo_hilbert_indices(M, N):
+    """
+    Return an array of shape (M*N, 2) giving (row, col) along a
+    space-filling curve over an M×N grid.
+
+    Power-of-two squares use the classic table from
+    generate_hilbert_indices (so existing ciphers are unchanged); any
+    other shape uses the generalized Hilbert curve with its major axis
+    along the longer side.
     """
-    indices = np.zeros((n * n, 2), dtype=int)
-    for i in range(n * n):
-        x, y = hilbert_index_to_xy(n, i)
-        indices[i] = [x, y]
+    M, N = int(M), int(N)
+    if M == N and _is_power_of_two(M):
+        return generate_hilbert_indices(M)
+
+    if N >= M:
+        uv = _gilbert_uv(N, M)
+        rows, cols = uv[:, 1], uv[:, 0]
+    else:
+        uv = _gilbert_uv(M, N)
+        rows, cols = uv[:, 0], uv[:, 1]
+
+    indices = np.empty((M * N, 2), dtype=int)
+    indices[:, 0] = rows
+    indices[:, 1] = cols
+    indices.setflags(write=False)
     return indices
 
 
 # --------- SCRAMBLING METHODS (PAPER-CONSISTENT) ---------
 
-def hilbert_method1_scramble(A_mat):
+def hilbert_method1_scramble(A_mat, indices=None):
     """
     Method 1 (Fig. 7a):
     - A_mat is the matrix of index labels (not pixel values), shape (M,N).
     - We traverse the matrix in Hilbert order and read *the labels*.
     - Output is IC1: a 1D permutation of [0..L-1] in the order specified by
       the Hilbert path applied to A_mat.
+    indices, if given, is a precomputed (M*N, 2) traversal table.
     """
     h, w = A_mat.shape
-    assert h == w, "Hilbert implementation assumes square matrix (M == N)."
 
-    # 1. Generate Hilbert (x,y) order over the h×h grid
-    indices = generate_hilbert_indices(h)  # (h*h, 2): x=row, y=col
+    # 1. Generate Hilbert (x,y) order over the h×w grid
+    if indices is None:
+        indices = generate_pseudo_hilbert_indices(h, w)  # (h*w, 2): x=row, y=col
 
     # 2. Extract labels in Hilbert order
     labels_in_hilbert = A_mat[indices[:, 0], indices[:, 1]]
@@ -65,23 +191,25 @@ def hilbert_method1_scramble(A_mat):
     return IC1
 
 
-def hilbert_method2_scramble(B_mat, fractal_perm):
+def hilbert_method2_scramble(B_mat, fractal_perm, indices=None):
     """
     Method 2 (Fig. 7b):
     - First arrange the labels B_mat into 1D (row-major).
     - Then assign those 1D labels onto the image grid following Hilbert order.
     - Additionally, we permute by a key (fractal_perm) as in your design.
     - Return IC2: a 1D permutation of [0..L-1].
+    indices, if given, is a precomputed (M*N, 2) traversal table.
     """
     h, w = B_mat.shape
-    assert h == w, "Hilbert implementation assumes square matrix (M == N)."
     L = h * w
 
     # 1. Row-major flatten of labels
     flat_labels = B_mat.reshape(-1, order='C')  # 0..L-1 in some scrambled order
 
-    # 2. Hilbert indices for h×h
-    hilbert_xy = generate_hilbert_indices(h)  # (L, 2)
+    # 2. Hilbert indices for h×w
+    if indices is None:
+        indices = generate_pseudo_hilbert_indices(h, w)
+    hilbert_xy = indices  # (L, 2)
 
     # 3. Optional fractal-based permutation of the 1D labels
     f_flat = fractal_perm.reshape(-1)
@@ -1,3 +1,6 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
 from PIL import Image
 import numpy as np
 import config
@@ -9,47 +12,121 @@ import os
 # BASIC IMAGE LOADING / SAVING
 # ==========================================================
 
-def load_image(path):
+def _read_bgr(path):
     if not os.path.exists(path):
         raise FileNotFoundError(f"Image not found: {path}")
 
     img = cv2.imread(path)
     if img is None:
         raise ValueError(f"Unable to read image: {path}")
+    return img
+
+
+def load_image(path, size=None):
+    """
+    Load an image as RGB. With size (W, H) it is resized while still BGR,
+    so the channel swap runs on the smaller frame; the swap is done in
+    place instead of allocating another full copy.
+    """
+    img = _read_bgr(path)
+    if size is not None and tuple(size) != (img.shape[1], img.shape[0]):
+        img = cv2.resize(img, tuple(size))
 
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
     return img
 
 
-def resize_image(img):
-    return cv2.resize(img, config.IMAGE_SIZE)
+def resize_image(img, size=None):
+    """
+    Resize to size (W, H), default config.IMAGE_SIZE. A size of None in
+    config means native resolution: the image is returned unchanged.
+    """
+    if size is None:
+        size = config.IMAGE_SIZE
+    if size is None or tuple(size) == (img.shape[1], img.shape[0]):
+        return img
+    return cv2.resize(img, tuple(size))
+
+
+def load_images(paths, size=None, pool=None):
+    """
+    Decode several files on a thread pool (OpenCV releases the GIL while
+    decoding and resizing). Returns the RGB images in input order.
+    """
+    if pool is None:
+        with ThreadPoolExecutor(max_workers=len(paths) or 1) as own_pool:
+            return load_images(paths, size, own_pool)
+    return [f.result() for f in
+            [pool.submit(load_image, p, size) for p in paths]]
+
+
+def prefetch_triples(triples, size=None, prefetch=1, workers=3,
+                     loader=None):
+    """
+    Yield (paths, (I1, I2, I3)) for each triple of paths, decoding the
+    next `prefetch` triples in the background while the caller works
+    on the current one. loader(path, size) defaults to load_image.
+    """
+    if loader is None:
+        loader = load_image
+    triples = iter(triples)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+
+        def submit_next():
+            for paths in triples:
+                pending.append(
+                    (paths, [pool.submit(loader, p, size) for p in paths])
+                )
+                return
+
+        for _ in range(prefetch + 1):
+            submit_next()
+
+        while pending:
+            paths, futures = pending.pop(0)
+            images = tuple(f.result() for f in futures)
+            submit_next()
+            yield paths, images
 
 
 def prepare_images(img1_path, img2_path, img3_path):
 
     print("[INFO] Loading images...")
 
-    I1 = load_image(img1_path)
-    I2 = load_image(img2_path)
-    I3 = load_image(img3_path)
+    if config.IMAGE_SIZE is None:
+        print("[INFO] Keeping native resolution")
+    else:
+        print("[INFO] Resizing images to:", config.IMAGE_SIZE)
 
-    print("[INFO] Resizing images to:", config.IMAGE_SIZE)
+    I1, I2, I3 = load_images((img1_path, img2_path, img3_path),
+                             config.IMAGE_SIZE)
 
-    I1 = resize_image(I1)
-    I2 = resize_image(I2)
-    I3 = resize_image(I3)
+    if not (I1.shape == I2.shape == I3.shape):
+        raise ValueError(
+            "Native resolution needs three images of the same size, got "
+            f"{I1.shape[:2]}, {I2.shape[:2]}, {I3.shape[:2]}"
+        )
 
     print("[INFO] Images successfully prepared")
 
     return I1, I2, I3
 
 
+def write_image(img, path):
+    """
+    Write an RGB image to an explicit path.
+    """
+    img_bgr = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+    if not cv2.imwrite(path, img_bgr):
+        raise ValueError(f"Unable to write image: {path}")
+
+
 def save_image(img, filename):
 
     path = os.path.join(config.OUTPUT_PATH, filename)
 
-    img_bgr = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-    cv2.imwrite(path, img_bgr)
+    write_image(img, path)
 
     print(f"[INFO] Image saved at: {path}")
 
@@ -58,52 +135,192 @@ def save_image(img, filename):
 # INDEXED IMAGE CONVERSION (USED BY ENCRYPTION)
 # ==========================================================
 
-def indexed_image_conversion(img):
+_PIL_METHODS = {
+    "mediancut": Image.MEDIANCUT,
+    "maxcoverage": Image.MAXCOVERAGE,
+    "fastoctree": Image.FASTOCTREE,
+}
+
+QUANTIZERS = tuple(_PIL_METHODS) + ("rgb332", "palette")
+
+# palettes shared by image sets with a common look, see palette_key
+_palette_cache = OrderedDict()
+_palette_cache_lock = threading.Lock()
+# one lock per palette_key, held while the key's first palette is built
+_palette_key_locks = {}
+
+
+def _palette_key_lock(palette_key):
+    with _palette_cache_lock:
+        lock = _palette_key_locks.get(palette_key)
+        if lock is None:
+            lock = _palette_key_locks[palette_key] = threading.Lock()
+        return lock
+
+
+def _cached_palette(palette_key):
+    with _palette_cache_lock:
+        palette = _palette_cache.get(palette_key)
+        if palette is not None:
+            _palette_cache.move_to_end(palette_key)
+        return palette
+
+
+def _cache_palette(palette_key, palette):
+    with _palette_cache_lock:
+        _palette_cache[palette_key] = palette
+        _palette_cache.move_to_end(palette_key)
+        while len(_palette_cache) > config.PALETTE_CACHE_SIZE:
+            old_key, _ = _palette_cache.popitem(last=False)
+            _palette_key_locks.pop(old_key, None)
+
+
+def _quantize_to_palette(pil_img, palette):
+    """
+    Map every pixel to the nearest colour of a fixed 256-entry palette.
+    """
+    pal_img = Image.new("P", (1, 1))
+    pal_img.putpalette(palette_table(palette).reshape(-1).tolist())
+    return pil_img.quantize(palette=pal_img, dither=Image.Dither.NONE)
+
+
+def _quantize_rgb332(img):
+    """
+    Fixed 3-3-2 bit palette: pure bit arithmetic, no colour search.
+    """
+    img = np.asarray(img, dtype=np.uint8)
+    index_matrix = ((img[:, :, 0] & 0xE0)
+                    | ((img[:, :, 1] & 0xE0) >> 3)
+                    | (img[:, :, 2] >> 6)).astype(np.uint8)
+
+    i = np.arange(256)
+    table = np.stack([(i >> 5) * 255 // 7,
+                      ((i >> 2) & 7) * 255 // 7,
+                      (i & 3) * 255 // 3], axis=1)
+    return index_matrix, table.reshape(-1).tolist()
+
+
+def indexed_image_conversion(img, method=None, palette=None,
+                             palette_key=None):
     """
     Convert RGB image to indexed format (256 colors).
+
+    method selects the quantizer (default config.QUANTIZER):
+        "mediancut", "maxcoverage", "fastoctree"  PIL quantize methods
+        "rgb332"                                  fixed 3-3-2 bit palette
+        "palette"                                 map onto `palette`
+    A supplied palette implies method "palette". With palette_key, the
+    palette of the first image quantized under that key is cached and
+    reused for later images with the same key.
+
     Returns:
         index_matrix (2D uint8)
         palette (768-length list)
     """
+    if palette is None and palette_key is not None:
+        with _palette_key_lock(palette_key):
+            palette = _cached_palette(palette_key)
+            if palette is None:
+                # first image under this key: concurrent callers wait on
+                # the key's lock and then map onto this palette
+                index_matrix, palette = indexed_image_conversion(img, method)
+                _cache_palette(palette_key, palette)
+                return index_matrix, palette
+
+    if palette is not None:
+        method = "palette"
+    elif method is None:
+        method = config.QUANTIZER
+
+    if method == "rgb332":
+        index_matrix, palette = _quantize_rgb332(img)
+    else:
+        pil_img = Image.fromarray(img)
+
+        if method == "palette":
+            if palette is None:
+                raise ValueError("method 'palette' needs a palette")
+            indexed = _quantize_to_palette(pil_img, palette)
+        elif method in _PIL_METHODS:
+            # Convert to 8-bit indexed image
+            indexed = pil_img.quantize(
+                colors=config.INDEXED_COLORS,
+                method=_PIL_METHODS[method]
+            )
+        else:
+            raise ValueError(
+                f"Unknown quantizer {method!r}, expected one of {QUANTIZERS}"
+            )
+
+        index_matrix = np.array(indexed, dtype=np.uint8)
+        palette = indexed.getpalette()
+
+    if palette_key is not None:
+        _cache_palette(palette_key, palette)
 
-    pil_img = Image.fromarray(img)
+    return index_matrix, palette
 
-    # Convert to 8-bit indexed image
-    indexed = pil_img.quantize(
-        colors=config.INDEXED_COLORS,
-        method=Image.MEDIANCUT
-    )
 
-    index_matrix = np.array(indexed, dtype=np.uint8)
-    palette = indexed.getpalette()
+def palette_table(palette):
+    """
+    (256, 3) uint8 lookup table for a flat RGB palette, laid out the way
+    PIL's putpalette does: short palettes are zero-filled, a trailing
+    partial entry and anything past 256 entries are ignored.
+    """
+    values = np.asarray(palette).reshape(-1)
+    if values.size and (values.min() < 0 or values.max() > 255):
+        raise ValueError("palette values must be in range(0, 256)")
 
-    return index_matrix, palette
+    n = min(values.size // 3, 256)
+    table = np.zeros((256, 3), dtype=np.uint8)
+    table[:n] = values[:3 * n].reshape(n, 3)
+    return table
 
 
-def indexed_to_rgb(index_matrix, palette):
+def indexed_to_rgb(index_matrix, palette, out=None):
     """
     Convert indexed image back to RGB using palette.
+    A single gather from the (256, 3) palette table; out, if given, is an
+    (H, W, 3) uint8 array that receives the result.
     """
+    index_matrix = np.asarray(index_matrix, dtype=np.uint8)
+    return np.take(palette_table(palette), index_matrix, axis=0, out=out)
 
-    indexed_img = Image.fromarray(index_matrix.astype(np.uint8), mode='P')
-    indexed_img.putpalette(palette)
 
-    rgb_img = indexed_img.convert("RGB")
+def indexed_to_rgb_batch(index_planes, palettes, out=None):
+    """
+    Expand several index planes of the same shape with their own palettes
+    in one call; returns (or fills out with) an (K, H, W, 3) array.
+    Planes are gathered one by one straight into out, so no widened
+    copy of the index planes is made.
+    """
+    index_planes = np.asarray(index_planes, dtype=np.uint8)
+    if out is None:
+        out = np.empty(index_planes.shape + (3,), dtype=np.uint8)
 
-    return np.array(rgb_img)
+    for k, palette in enumerate(palettes):
+        np.take(palette_table(palette), index_planes[k], axis=0, out=out[k])
+    return out
 
 
 # ==========================================================
 # BULK INDEXED PREPARATION
 # ==========================================================
 
-def prepare_indexed_images(I1, I2, I3):
+def prepare_indexed_images(I1, I2, I3, method=None, palette_key=None):
+    """
+    Quantize the three images concurrently (PIL releases the GIL while
+    quantizing). method / palette_key as in indexed_image_conversion.
+    """
 
     print("[INFO] Converting images to indexed format...")
 
-    I1_index, MAP1 = indexed_image_conversion(I1)
-    I2_index, MAP2 = indexed_image_conversion(I2)
-    I3_index, MAP3 = indexed_image_conversion(I3)
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(indexed_image_conversion, I, method,
+                               None, palette_key)
+                   for I in (I1, I2, I3)]
+        (I1_index, MAP1), (I2_index, MAP2), (I3_index, MAP3) = \
+            [f.result() for f in futures]
 
     print("[INFO] Indexed image conversion completed")
 
@@ -125,42 +342,11 @@ def recover_rgb_images(CR, CG, CB, MAP1, MAP2, MAP3):
 
     return R_img, G_img, B_img
 
-# ==========================================================
-# INDEXED IMAGE CONVERSION (USED BY ENCRYPTION)
-# ==========================================================
-
-def indexed_image_conversion(img):
-    """
-    Convert RGB image to indexed format (256 colors).
-    Returns:
-        index_matrix (2D uint8)
-        palette (768-length list)
-    """
-    # ... (Your existing code)
-    pil_img = Image.fromarray(img)
-    
-    # Assuming config.INDEXED_COLORS = 256
-    indexed = pil_img.quantize(
-        colors=256, 
-        method=Image.MEDIANCUT
-    )
-
-    index_matrix = np.array(indexed, dtype=np.uint8)
-    palette = indexed.getpalette()
-
-    return index_matrix, palette
-
-
 def inverse_indexed_image_conversion(index_matrix, palette):
     """
     Convert indexed image back to RGB using palette.
     (Renamed to match the decryption module call)
     """
-    indexed_img = Image.fromarray(index_matrix.astype(np.uint8), mode='P')
-    indexed_img.putpalette(palette)
-
-    rgb_img = indexed_img.convert("RGB")
-
-    return np.array(rgb_img)
+    return indexed_to_rgb(index_matrix, palette)
 
 # Alias for your internal bulk recovery function
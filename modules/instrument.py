@@ -0,0 +1,156 @@
+import contextlib
+import contextvars
+import time
+import tracemalloc
+
+
+# ==========================================================
+# PIPELINE STAGES
+# ==========================================================
+
+STAGES = (
+    "key_derivation",
+    "fractal",
+    "hilbert",
+    "chaos",
+    "scaling",
+    "diffusion_stage1",
+    "diffusion_stage2",
+    "palette_expansion",
+)
+
+# Recorder of the current context; None means instrumentation is off and
+# stage() costs one ContextVar lookup.
+_active = contextvars.ContextVar("stage_recorder", default=None)
+_NULL = contextlib.nullcontext()
+
+
+def stage(name):
+    """
+    Context manager timing one pipeline stage while a recorder is active
+    (see record_stages); a shared no-op otherwise.
+    """
+    recorder = _active.get()
+    if recorder is None:
+        return _NULL
+    return _Stage(recorder, name)
+
+
+class _Stage:
+    __slots__ = ("recorder", "name", "wall", "cpu", "mem_start", "mem_peak")
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.recorder._push(self)
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        self.recorder._pop(self, wall, cpu)
+        return False
+
+
+# ==========================================================
+# RECORDER
+# ==========================================================
+
+class StageRecorder:
+    """
+    Collects one record per stage run:
+        {"stage", "depth", "wall", "cpu", "peak_bytes"}
+    wall / cpu are seconds (cpu is process time, so it includes worker
+    threads); peak_bytes is the peak traced allocation above the level at
+    stage entry, or None when memory tracking is off. callback, if given,
+    is called with each record as its stage finishes.
+    """
+
+    def __init__(self, callback=None, memory=True):
+        self.callback = callback
+        self.memory = memory
+        self.records = []
+        self._stack = []
+
+    def _push(self, st):
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # fold the peak seen so far into the enclosing stage before
+            # resetting it for this one
+            if self._stack:
+                parent = self._stack[-1]
+                parent.mem_peak = max(parent.mem_peak, peak)
+            tracemalloc.reset_peak()
+            st.mem_start = current
+            st.mem_peak = current
+        self._stack.append(st)
+
+    def _pop(self, st, wall, cpu):
+        self._stack.pop()
+        peak_bytes = None
+        if self.memory:
+            peak = max(st.mem_peak, tracemalloc.get_traced_memory()[1])
+            peak_bytes = peak - st.mem_start
+            if self._stack:
+                parent = self._stack[-1]
+                parent.mem_peak = max(parent.mem_peak, peak)
+
+        record = {"stage": st.name, "depth": len(self._stack),
+                  "wall": wall, "cpu": cpu, "peak_bytes": peak_bytes}
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def summary(self):
+        """
+        Per-stage totals: {stage: {"calls", "wall", "cpu", "peak_bytes"}},
+        with peak_bytes the largest peak of any call.
+        """
+        totals = {}
+        for r in self.records:
+            t = totals.setdefault(r["stage"], {"calls": 0, "wall": 0.0,
+                                               "cpu": 0.0, "peak_bytes": None})
+            t["calls"] += 1
+            t["wall"] += r["wall"]
+            t["cpu"] += r["cpu"]
+            if r["peak_bytes"] is not None:
+                t["peak_bytes"] = max(t["peak_bytes"] or 0, r["peak_bytes"])
+        return totals
+
+    def report(self):
+        lines = [f"{'stage':<20}{'calls':>6}{'wall ms':>11}"
+                 f"{'cpu ms':>11}{'peak MB':>10}"]
+        for name, t in self.summary().items():
+            peak = "-" if t["peak_bytes"] is None else f"{t['peak_bytes'] / 1e6:.2f}"
+            lines.append(f"{name:<20}{t['calls']:>6}{t['wall'] * 1e3:>11.3f}"
+                         f"{t['cpu'] * 1e3:>11.3f}{peak:>10}")
+        return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def record_stages(callback=None, memory=True):
+    """
+    Instrument every pipeline stage run in this context:
+
+        with instrument.record_stages() as rec:
+            encryption.encrypt_three_images(I1, I2, I3, key)
+        print(rec.report())
+
+    memory=True traces allocations with tracemalloc (started here if it is
+    not already running), which slows allocation-heavy code somewhat.
+    """
+    recorder = StageRecorder(callback, memory)
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    token = _active.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _active.reset(token)
+        if started:
+            tracemalloc.stop()
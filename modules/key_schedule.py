@@ -0,0 +1,146 @@
+import hashlib
+import numpy as np
+from modules import fractal
+from modules import cicsml
+from modules import instrument
+
+
+# Bump whenever a change alters IC1 / IC2 / Fmat or the keystreams,
+# so persisted schedules from older code are never reused.
+ALGORITHM_VERSION = 1
+
+
+# ==========================================================
+# KEY DERIVATION / KEYSTREAM HELPERS
+# ==========================================================
+
+def derive_key_parts(user_key: str):
+    key_bytes = hashlib.sha384(user_key.encode()).digest()
+    Keys = []
+    for i in range(12):
+        seg = key_bytes[4 * i:4 * (i + 1)]
+        Keys.append(int.from_bytes(seg, "big", signed=False))
+    return Keys
+
+
+def scale_chaos(D, L):
+    """
+    Map chaotic values in [0, 1) to key bytes: floor(D * 1e14) mod 256.
+    uint8 input is taken as already scaled and passed through.
+    """
+    if isinstance(D, np.ndarray) and D.dtype == np.uint8:
+        return D[:L]
+    D = np.asarray(D[:L], dtype=np.float64)
+    # floor(D * 1e14) is an exact integer below 2**53, so taking the low
+    # byte of its int64 value equals the float mod 256
+    D = np.floor(D * 1e14).astype(np.int64)
+    return (D & 255).astype(np.uint8)
+
+
+def generate_chaos_sequences(user_key, length, generate=None):
+    chaos = cicsml.generate_chaos_with_key(user_key, length=8 * length,
+                                           generate=generate)
+
+    if isinstance(chaos, tuple) and len(chaos) == 8:
+        return chaos
+
+    chaos = np.asarray(chaos).flatten()
+    return np.split(chaos, 8)
+
+
+# ==========================================================
+# KEY SCHEDULE
+# ==========================================================
+
+def _inverse_permutation(P):
+    inv = np.empty(P.size, dtype=np.int64)
+    inv[P] = np.arange(P.size, dtype=np.int64)
+    return inv
+
+
+class KeySchedule:
+    """
+    Everything the cipher derives from (key, H, W), built once:
+    the IC1 / IC2 permutations, the 2x2 Fmat and the eight keystreams
+    D1..D8 already scaled to uint8.
+    """
+
+    __slots__ = ("H", "W", "IC1", "IC2", "Fmat",
+                 "D1", "D2", "D3", "D4", "D5", "D6", "D7", "D8",
+                 "_IC1_inv", "_IC2_inv")
+
+    def __init__(self, H, W, IC1, IC2, Fmat, keystreams):
+        self.H = H
+        self.W = W
+        self.IC1 = IC1
+        self.IC2 = IC2
+        self.Fmat = Fmat
+        (self.D1, self.D2, self.D3, self.D4,
+         self.D5, self.D6, self.D7, self.D8) = keystreams
+        self._IC1_inv = None
+        self._IC2_inv = None
+
+    @property
+    def keystreams(self):
+        return (self.D1, self.D2, self.D3, self.D4,
+                self.D5, self.D6, self.D7, self.D8)
+
+    def inverse_IC1(self):
+        """
+        Position n with IC1[n] == p, for every p (built once, then cached).
+        """
+        if self._IC1_inv is None:
+            self._IC1_inv = _inverse_permutation(self.IC1)
+        return self._IC1_inv
+
+    def inverse_IC2(self):
+        if self._IC2_inv is None:
+            self._IC2_inv = _inverse_permutation(self.IC2)
+        return self._IC2_inv
+
+    def __repr__(self):
+        return f"KeySchedule(H={self.H}, W={self.W})"
+
+
+def build_key_schedule(user_key: str, H, W, engine=None):
+    """
+    Run key derivation, the fractal / Hilbert permutations and CICSML
+    once for an H×W image. The float64 chaos buffer is dropped as soon
+    as the eight keystreams are scaled.
+
+    engine (a modules.engines.Engine) supplies the Hilbert table and
+    chaos generator; by default the module implementations are used.
+    """
+    L = H * W
+    hilbert_indices = engine.hilbert_indices if engine is not None else None
+    chaos_generate = engine.chaos if engine is not None else None
+
+    with instrument.stage("key_derivation"):
+        Keys = derive_key_parts(user_key)
+    _, IC1, IC2, Fmat = fractal.build_fractal_matrix(H, W, Keys,
+                                                     hilbert_indices)
+
+    chaos = generate_chaos_sequences(user_key, L, chaos_generate)
+    with instrument.stage("scaling"):
+        keystreams = tuple(scale_chaos(D, L) for D in chaos)
+    del chaos
+
+    return KeySchedule(H, W,
+                       np.asarray(IC1, dtype=np.int64),
+                       np.asarray(IC2, dtype=np.int64),
+                       np.asarray(Fmat, dtype=np.int64),
+                       keystreams)
+
+
+def resolve_key_schedule(key, H, W, engine=None):
+    """
+    Accept either a raw key string or a prebuilt KeySchedule and return
+    a schedule for an H×W image (built with engine's components).
+    """
+    if isinstance(key, KeySchedule):
+        if (key.H, key.W) != (H, W):
+            raise ValueError(
+                f"Key schedule built for {key.H}x{key.W}, image is {H}x{W}"
+            )
+        return key
+    return build_key_schedule(key, H, W, engine)
@@ -0,0 +1,164 @@
+import numpy as np
+
+
+DIRECTIONS = ("horizontal", "vertical", "diagonal")
+
+
+# ==========================================================
+# HISTOGRAM-BASED METRICS
+# ==========================================================
+
+def _as_channels(img):
+    """
+    (H, W, C) view of an image; a 2-D image is a single channel.
+    """
+    img = np.asarray(img)
+    return img[:, :, None] if img.ndim == 2 else img
+
+
+def channel_histograms(img):
+    """
+    256-bin histogram of every channel of a uint8 image, one bincount
+    per channel; returns a (C, 256) int64 array.
+    """
+    img = _as_channels(img)
+    return np.stack([np.bincount(img[:, :, c].ravel(), minlength=256)
+                     for c in range(img.shape[2])])
+
+
+def entropy_from_hist(hist):
+    """
+    Shannon entropy (bits) of each histogram along the last axis.
+    """
+    hist = np.asarray(hist, dtype=np.float64)
+    p = hist / hist.sum(axis=-1, keepdims=True)
+    logp = np.log2(p, out=np.zeros_like(p), where=p > 0)
+    return -(p * logp).sum(axis=-1)
+
+
+def chi_square_from_hist(hist):
+    """
+    Chi-square statistic of each histogram against a uniform one.
+    """
+    hist = np.asarray(hist, dtype=np.float64)
+    expected = hist.sum(axis=-1, keepdims=True) / hist.shape[-1]
+    return ((hist - expected) ** 2 / expected).sum(axis=-1)
+
+
+# ==========================================================
+# ADJACENT-PIXEL CORRELATION
+# ==========================================================
+
+def _neighbour_views(img, direction):
+    if direction == "horizontal":
+        return img[:, :-1], img[:, 1:]
+    if direction == "vertical":
+        return img[:-1, :], img[1:, :]
+    if direction == "diagonal":
+        return img[:-1, :-1], img[1:, 1:]
+    raise ValueError(f"Unknown direction {direction!r}, "
+                     f"expected one of {DIRECTIONS}")
+
+
+def _pearson(x, y):
+    """
+    Per-channel Pearson coefficient of two (h, w, C) uint8 views.
+    The sums are exact integers (einsum casts block by block, so the
+    views are never copied); only the final ratio is floating point.
+    """
+    n = x.shape[0] * x.shape[1]
+    sx = x.sum(axis=(0, 1), dtype=np.int64)
+    sy = y.sum(axis=(0, 1), dtype=np.int64)
+    sxx = np.einsum("ijc,ijc->c", x, x, dtype=np.int64)
+    syy = np.einsum("ijc,ijc->c", y, y, dtype=np.int64)
+    sxy = np.einsum("ijc,ijc->c", x, y, dtype=np.int64)
+
+    r = []
+    for c in range(x.shape[2]):
+        # Python ints: n * sxy can exceed int64 for large images
+        cov = n * int(sxy[c]) - int(sx[c]) * int(sy[c])
+        vx = n * int(sxx[c]) - int(sx[c]) ** 2
+        vy = n * int(syy[c]) - int(sy[c]) ** 2
+        r.append(cov / (vx * vy) ** 0.5 if vx and vy else float("nan"))
+    return np.array(r)
+
+
+def adjacent_correlation(img, direction="horizontal"):
+    """
+    Correlation of neighbouring pixels in one direction, per channel.
+    """
+    img = _as_channels(img)
+    return _pearson(*_neighbour_views(img, direction))
+
+
+# ==========================================================
+# DIFFERENTIAL METRICS
+# ==========================================================
+
+def npcr(img1, img2):
+    """
+    Number of Pixel Change Rate (%) per channel.
+    """
+    a, b = _as_channels(img1), _as_channels(img2)
+    if a.shape != b.shape:
+        raise ValueError("NPCR needs images of the same shape")
+    return np.count_nonzero(a != b, axis=(0, 1)) * 100.0 / (a.shape[0] * a.shape[1])
+
+
+def uaci(img1, img2):
+    """
+    Unified Average Changing Intensity (%) per channel.
+    """
+    a, b = _as_channels(img1), _as_channels(img2)
+    if a.shape != b.shape:
+        raise ValueError("UACI needs images of the same shape")
+    # |a - b| of uint8 values without widening: max - min
+    diff = np.maximum(a, b)
+    diff -= np.minimum(a, b)
+    return diff.sum(axis=(0, 1), dtype=np.int64) * 100.0 / (255.0 * a.shape[0] * a.shape[1])
+
+
+# ==========================================================
+# ALL-CHANNEL REPORT
+# ==========================================================
+
+def image_metrics(img, channel_names=None):
+    """
+    Histogram, entropy, chi-square and the three adjacent-pixel
+    correlations of every channel, in one pass over the image.
+
+    Returns {name: {"histogram", "entropy", "chi_square",
+                    "correlation": {direction: r}}}
+    with channel names defaulting to R, G, B (or "0", "1", ...).
+    """
+    img = _as_channels(img)
+    C = img.shape[2]
+    if channel_names is None:
+        channel_names = ("R", "G", "B") if C == 3 else [str(c) for c in range(C)]
+
+    hist = channel_histograms(img)
+    ent = entropy_from_hist(hist)
+    chi = chi_square_from_hist(hist)
+    corr = {d: adjacent_correlation(img, d) for d in DIRECTIONS}
+
+    return {
+        name: {
+            "histogram": hist[c],
+            "entropy": float(ent[c]),
+            "chi_square": float(chi[c]),
+            "correlation": {d: float(corr[d][c]) for d in DIRECTIONS},
+        }
+        for c, name in enumerate(channel_names)
+    }
+
+
+def difference_metrics(img1, img2, channel_names=None):
+    """
+    NPCR and UACI of every channel: {name: {"npcr", "uaci"}}.
+    """
+    n = npcr(img1, img2)
+    u = uaci(img1, img2)
+    if channel_names is None:
+        channel_names = ("R", "G", "B") if n.size == 3 else [str(c) for c in range(n.size)]
+    return {name: {"npcr": float(n[c]), "uaci": float(u[c])}
+            for c, name in enumerate(channel_names)}
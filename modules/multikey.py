@@ -0,0 +1,389 @@
+import argparse
+import sys
+import time
+import numpy as np
+import config
+from modules import cicsml
+from modules import fractal
+from modules import image_utils
+from modules import instrument
+from modules.key_schedule import derive_key_parts
+
+
+# ==========================================================
+# MULTI-KEY BATCH ENGINE
+# ==========================================================
+#
+# Encrypts K index triples of one size with K different keys in a single
+# pass. IC1 / IC2 depend only on the image size and are built once; the
+# per-key parts (Fmat and the CICSML keystreams) are computed for all K
+# keys at once, with the lattice held as a (K, 9) state and the Chebyshev
+# coupling as a (K,) vector. Every result is byte-identical to
+# encrypt_three_images / decrypt_three_images with the same key.
+
+
+# ---------- CICSML FOR K KEYS ----------
+
+def cicsml_keystreams(a, b, p0, x0, length, block=256):
+    """
+    Scaled CICSML output for K keys: a (K, length) uint8 array whose row
+    k equals scale_chaos(cicsml_generate(length, a[k], b[k], p0[k],
+    x0[k]), length). The float64 states are scaled `block` lattice steps
+    at a time, so memory stays O(K * length) bytes.
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    p = np.array(p0, dtype=np.float64)
+    K = a.size
+    N_lattice = 9
+
+    x = (np.asarray(x0, dtype=np.float64)[:, None]
+         + 0.001 * np.arange(N_lattice)) % 1.0
+
+    # per-key constants of the lattice update, as (K, 1) columns
+    g_coef = (4.0 / (a - 0.5))[:, None]
+    keep = np.empty((K, 1), dtype=np.float64)
+    half = np.empty((K, 1), dtype=np.float64)
+    g = np.empty((K, N_lattice), dtype=np.float64)
+    nb = np.empty((K, N_lattice), dtype=np.float64)
+
+    def step(x, out):
+        # same operations, in the same order, as cicsml.logistic_sine_map
+        np.cos(b * np.arccos(p, out=p), out=p)
+        np.subtract(1.0, p[:, None], out=keep)
+        np.divide(p[:, None], 2.0, out=half)
+
+        np.multiply(x, np.pi, out=g)
+        np.sin(g, out=g)
+        np.multiply(g, g_coef, out=g)
+
+        # g(x(i+1)) + g(x(i-1)) on the periodic lattice
+        nb[:, :-1] = g[:, 1:]
+        nb[:, -1] = g[:, 0]
+        nb[:, 1:] += g[:, :-1]
+        nb[:, 0] += g[:, -1]
+
+        np.multiply(g, keep, out=out)
+        np.multiply(nb, half, out=nb)
+        np.add(out, nb, out=out)
+        np.mod(out, 1.0, out=out)
+        return out
+
+    x_next = np.empty((K, N_lattice), dtype=np.float64)
+    for _ in range(config.TRANSIENT_ITER):
+        step(x, x_next)
+        x, x_next = x_next, x
+
+    steps = -(-int(length) // N_lattice)
+    keystreams = np.empty((K, steps, N_lattice), dtype=np.uint8)
+    buf = np.empty((min(block, steps), K, N_lattice), dtype=np.float64)
+
+    for t0 in range(0, steps, buf.shape[0]):
+        n = min(buf.shape[0], steps - t0)
+        for t in range(n):
+            x = step(x, buf[t])
+        # scale_chaos, written time-major into each key's row
+        scaled = np.floor(buf[:n] * 1e14).astype(np.int64)
+        keystreams[:, t0:t0 + n] = (scaled & 255).transpose(1, 0, 2)
+
+    return keystreams.reshape(K, -1)[:, :length]
+
+
+# ---------- KEY SCHEDULE FOR K KEYS ----------
+
+class MultiKeySchedule:
+    """
+    Key material for K keys at one H×W size: the shared IC1 / IC2
+    permutations, the per-key stage-two positions k_all (K, L) and the
+    keystreams D (K, 8, L) uint8, D[:, j] being D_{j+1}.
+    """
+
+    __slots__ = ("H", "W", "K", "IC1", "IC2", "k_all", "D")
+
+    def __init__(self, H, W, IC1, IC2, k_all, D):
+        self.H = H
+        self.W = W
+        self.K = D.shape[0]
+        self.IC1 = IC1
+        self.IC2 = IC2
+        self.k_all = k_all
+        self.D = D
+
+    def __repr__(self):
+        return f"MultiKeySchedule(K={self.K}, H={self.H}, W={self.W})"
+
+
+def build_multikey_schedule(keys, H, W):
+    """
+    Derive the schedules of every key in keys for an H×W image at once.
+    """
+    keys = list(keys)
+    if not keys:
+        raise ValueError("keys must not be empty")
+    L = H * W
+
+    with instrument.stage("key_derivation"):
+        Keys = np.array([derive_key_parts(k) for k in keys], dtype=np.int64)
+        a, b, x0, p0 = np.array(
+            [cicsml.derive_initial_conditions_from_key(k) for k in keys]
+        ).T
+
+    # IC1 / IC2 only depend on the size; Fmat is rebuilt below per key
+    _, IC1, IC2, _ = fractal.build_fractal_matrix(H, W, Keys[0].tolist())
+
+    with instrument.stage("fractal"):
+        e = int(np.floor(np.log2(max(H, W)))) + 1
+        size = 2 ** e
+        xs = Keys[:, 0:4] % (size - 1)
+        ys = Keys[:, 4:8] % (size - 1)
+        # Fmat = [[F0, F1], [F2, F3]]; stage two only uses its second row
+        F = fractal.fractal_entries(xs, ys, size).astype(np.int64)
+        c, d = F[:, 2:3], F[:, 3:4]
+        k_all = (c * np.arange(L, dtype=np.int64) + d) % max(L - 1, 1)
+
+    with instrument.stage("chaos"):
+        D = cicsml_keystreams(a, b, p0, x0, 8 * L)
+
+    return MultiKeySchedule(H, W, IC1, IC2, k_all, D.reshape(len(keys), 8, L))
+
+
+def _resolve(keys, H, W, K):
+    if isinstance(keys, MultiKeySchedule):
+        mks = keys
+        if (mks.H, mks.W) != (H, W):
+            raise ValueError(
+                f"Schedule built for {mks.H}x{mks.W}, images are {H}x{W}"
+            )
+    else:
+        mks = build_multikey_schedule(keys, H, W)
+    if mks.K != K:
+        raise ValueError(f"{mks.K} keys for {K} images")
+    return mks
+
+
+# ---------- DIFFUSION ACROSS THE BATCH AXIS ----------
+
+def _xor_scan3_many(U):
+    """
+    encryption._xor_scan3 along axis 1 of a (K, L) array, in place.
+    """
+    K, L = U.shape
+    P = np.zeros((K, L + (-L) % 3), dtype=np.uint8)
+    P[:, :L] = U
+    P3 = P.reshape(K, -1, 3)
+    np.bitwise_xor.accumulate(P3, axis=1, out=P3)
+    U[:, :1] = P[:, :1]
+    np.bitwise_xor(P[:, 1:L], P[:, :L - 1], out=U[:, 1:])
+    return U
+
+
+def _chain_inputs_many(V, taps, D0, d7, d8, T_lag2=None):
+    """
+    encryption._chain_inputs for K chains (rows of V), in place; D0, d7
+    and d8 are (K, 1) columns.
+    """
+    head = V[:, :2].copy()
+    V ^= taps
+    if V.shape[1] > 0:
+        V[:, :1] = head[:, :1] ^ d7 ^ d8 ^ D0
+    if V.shape[1] > 1:
+        V[:, 1:2] = head[:, 1:] ^ d7 ^ D0
+    if T_lag2 is not None and V.shape[1] > 2:
+        V[:, 2:] ^= T_lag2[:, :-2]
+    return V
+
+
+def _reverse_chain_many(T, taps, D0, d7, d8, T_lag2=None):
+    """
+    decryption._reverse_chain for K chains (rows of T).
+    """
+    if T_lag2 is None:
+        T_lag2 = T
+    L = T.shape[1]
+    V = np.empty_like(T)
+    if L > 0:
+        V[:, :1] = T[:, :1] ^ d7 ^ d8 ^ D0
+    if L > 1:
+        V[:, 1:2] = T[:, 1:2] ^ d7 ^ T[:, :1] ^ D0
+    if L > 2:
+        np.bitwise_xor(T[:, 2:], T_lag2[:, :-2], out=V[:, 2:])
+        V[:, 2:] ^= T[:, 1:-1]
+        V[:, 2:] ^= taps[:, 2:]
+    return V
+
+
+def _shifted(D):
+    # stage-one taps D[max(n - 1, 0)] for every row
+    taps = np.empty_like(D)
+    taps[:, :1] = D[:, :1]
+    taps[:, 1:] = D[:, :-1]
+    return taps
+
+
+def _as_planes(images):
+    """
+    (K, 3, H, W) uint8 array from an array or a sequence of triples.
+    """
+    images = np.asarray(images, dtype=np.uint8)
+    if images.ndim != 4 or images.shape[1] != 3:
+        raise ValueError("images must be K triples of H×W index planes")
+    return images
+
+
+def encrypt_many(images, keys, out=None):
+    """
+    Encrypt K index triples (a (K, 3, H, W) array or K (I1, I2, I3)
+    triples) with keys[k] for triple k, which may also be a prebuilt
+    MultiKeySchedule. Returns (or fills out with) the (K, H, W, 3)
+    ciphers; out[k] equals encrypt_three_images(*images[k], keys[k]).
+    """
+    I = _as_planes(images)
+    K, _, H, W = I.shape
+    L = H * W
+    mks = _resolve(keys, H, W, K)
+    D = mks.D
+
+    if out is None:
+        out = np.empty((K, H, W, 3), dtype=np.uint8)
+    d7 = D[:, 6, L - 1:L]
+    d8 = D[:, 7, L - 1:L]
+
+    # column-major flattening of every plane
+    v = I.transpose(0, 1, 3, 2).reshape(K, 3, L)
+
+    with instrument.stage("diffusion_stage1"):
+        T = []
+        for ch in range(3):
+            Dj = D[:, 2 * ch]
+            U = np.take(v[:, ch], mks.IC1, axis=1)
+            _chain_inputs_many(U, _shifted(Dj), Dj[:, :1], d7, d8,
+                               T_lag2=T[0] if ch == 1 else None)
+            if ch == 1:
+                np.bitwise_xor.accumulate(U, axis=1, out=U)
+            else:
+                _xor_scan3_many(U)
+            T.append(U)
+
+    with instrument.stage("diffusion_stage2"):
+        for ch in range(3):
+            Dj = D[:, 2 * ch + 1]
+            U = np.take(T[ch], mks.IC2, axis=1)
+            _chain_inputs_many(U, np.take_along_axis(Dj, mks.k_all, axis=1),
+                               Dj[:, :1], d7, d8)
+            _xor_scan3_many(U)
+            out[:, :, :, ch] = U.reshape(K, W, H).transpose(0, 2, 1)
+
+    return out
+
+
+def decrypt_many(C, keys, palettes=None):
+    """
+    Inverse of encrypt_many for (K, H, W, 3) ciphers. Returns the
+    (K, 3, H, W) index planes, or with palettes (K (MAP1, MAP2, MAP3)
+    triples) the (K, 3, H, W, 3) RGB images.
+    """
+    C = np.asarray(C, dtype=np.uint8)
+    if C.ndim != 4 or C.shape[3] != 3:
+        raise ValueError("C must be a (K, H, W, 3) array of ciphers")
+    K, H, W, _ = C.shape
+    L = H * W
+    mks = _resolve(keys, H, W, K)
+    D = mks.D
+
+    d7 = D[:, 6, L - 1:L]
+    d8 = D[:, 7, L - 1:L]
+    cflat = C.transpose(0, 3, 2, 1).reshape(K, 3, L)
+
+    with instrument.stage("diffusion_stage2"):
+        T = np.empty((3, K, L), dtype=np.uint8)
+        for ch in range(3):
+            Dj = D[:, 2 * ch + 1]
+            V = _reverse_chain_many(cflat[:, ch],
+                                    np.take_along_axis(Dj, mks.k_all, axis=1),
+                                    Dj[:, :1], d7, d8)
+            T[ch][:, mks.IC2] = V
+
+    with instrument.stage("diffusion_stage1"):
+        planes = np.empty((K, 3, L), dtype=np.uint8)
+        for ch in range(3):
+            Dj = D[:, 2 * ch]
+            V = _reverse_chain_many(T[ch], _shifted(Dj), Dj[:, :1], d7, d8,
+                                    T_lag2=T[0] if ch == 1 else None)
+            planes[:, ch][:, mks.IC1] = V
+
+    planes = planes.reshape(K, 3, W, H).transpose(0, 1, 3, 2)
+    if palettes is None:
+        return planes
+
+    with instrument.stage("palette_expansion"):
+        rgb = image_utils.indexed_to_rgb_batch(
+            planes.reshape(3 * K, H, W),
+            [p for triple in palettes for p in triple]
+        )
+    return rgb.reshape(K, 3, H, W, 3)
+
+
+def encrypt_many_chunked(images, keys, chunk=None):
+    """
+    encrypt_many over chunks of config.MULTIKEY_BATCH keys, bounding the
+    keystream memory (8 * H * W bytes per key) for very large batches.
+    """
+    I = _as_planes(images)
+    keys = list(keys)
+    if len(keys) != I.shape[0]:
+        raise ValueError(f"{len(keys)} keys for {I.shape[0]} images")
+    chunk = chunk or config.MULTIKEY_BATCH
+
+    K, _, H, W = I.shape
+    out = np.empty((K, H, W, 3), dtype=np.uint8)
+    for s in range(0, K, chunk):
+        encrypt_many(I[s:s + chunk], keys[s:s + chunk], out=out[s:s + chunk])
+    return out
+
+
+# ==========================================================
+# COMMAND LINE
+# ==========================================================
+
+def main(argv=None):
+    from modules import encryption
+
+    parser = argparse.ArgumentParser(
+        prog="python -m modules.multikey",
+        description="Check the multi-key engine against per-key encryption "
+                    "and time both."
+    )
+    parser.add_argument("--keys", type=int, default=64)
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    n = args.size
+    keys = [rng.bytes(12).hex() for _ in range(args.keys)]
+    I = rng.integers(0, 256, (args.keys, 3, n, n), dtype=np.uint8)
+
+    start = time.perf_counter()
+    C = encrypt_many_chunked(I, keys)
+    batched = time.perf_counter() - start
+
+    start = time.perf_counter()
+    single = [encryption.encrypt_three_images(*I[k], keys[k])
+              for k in range(args.keys)]
+    per_key = time.perf_counter() - start
+
+    bad = [k for k in range(args.keys) if not np.array_equal(C[k], single[k])]
+    back = decrypt_many(C[:8], keys[:8])
+    if bad or not np.array_equal(back, I[:8]):
+        print(f"[MISMATCH] keys {bad[:8]}" if bad else "[MISMATCH] round trip")
+        return 1
+
+    print(f"[OK] {args.keys} keys, {n}x{n}: "
+          f"{batched / args.keys * 1e3:.3f} ms/triple batched, "
+          f"{per_key / args.keys * 1e3:.3f} ms/triple per key "
+          f"({per_key / batched:.1f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,381 @@
+import numpy as np
+import config
+
+
+# ==========================================================
+# REFERENCE IMPLEMENTATIONS
+# ==========================================================
+#
+# The original per-element loops of the cipher, kept verbatim (minus the
+# debug prints) as the ground truth for modules.engines: every faster
+# engine must reproduce these byte for byte. They are slow (one Python
+# iteration per pixel) and not meant for production use.
+#
+# The primitives they build on (Hilbert rotation, Chebyshev and lattice
+# maps) are copied here unchanged from the original modules rather than
+# imported, so a change to the production code cannot change the
+# reference along with it.
+
+
+# --------- HILBERT CURVE CORE LOGIC ---------
+
+def rot(n, x, y, rx, ry):
+    if ry == 0:
+        if rx == 1:
+            x = n - 1 - x
+            y = n - 1 - y
+        return y, x
+    return x, y
+
+
+def hilbert_index_to_xy(n, d):
+    """
+    Map 1D Hilbert index d -> 2D (x,y), for an n×n grid (n power of 2).
+    """
+    t = d
+    x = y = 0
+    s = 1
+    while s < n:
+        rx = 1 & (t // 2)
+        ry = 1 & (t ^ rx)
+        x, y = rot(s, x, y, rx, ry)
+        x += s * rx
+        y += s * ry
+        t //= 4
+        s *= 2
+    return x, y
+
+
+# --------- CICSML MAPS ---------
+
+def chebyshev_map(p, b):
+    # p_{n+1} = cos(b * arccos(p_n))
+    return np.cos(b * np.arccos(p))
+
+
+def logistic_sine_map(x, a, p):
+    """
+    CICSML lattice update (Eq. (2)):
+    x_{n+1}(i) = mod{ (1 - p) * g(x_n(i))
+                      + p/2 * ( g(x_n(i+1)) + g(x_n(i-1)) ), 1 }
+    g(x) = 4/(a - 0.5) * sin(pi * x)      (Eq. (3))
+    """
+    x = np.asarray(x, dtype=float)
+    N = x.size
+
+    # local map g(x)
+    g_vals = (4.0 / (a - 0.5)) * np.sin(np.pi * x)
+
+    # periodic neighbors
+    idx = np.arange(N)
+    left_idx = (idx + 1) % N
+    right_idx = (idx - 1) % N
+
+    g_left = g_vals[left_idx]
+    g_right = g_vals[right_idx]
+
+    x_next = (1.0 - p) * g_vals + (p / 2.0) * (g_left + g_right)
+    x_next = np.mod(x_next, 1.0)
+    return x_next
+
+
+# --------- REFERENCE PIPELINE ---------
+
+def scale_chaos(D, L):
+    D = np.asarray(D[:L], dtype=np.float64)
+    D = np.mod(np.floor(D * 1e14), 256)
+    return D.astype(np.uint8)
+
+
+def _keystream(D, L):
+    # schedules hold keystreams already scaled to uint8
+    if isinstance(D, np.ndarray) and D.dtype == np.uint8:
+        return D[:L]
+    return scale_chaos(D, L)
+
+
+def generate_hilbert_indices(n):
+    """
+    Return an array of shape (n*n, 2) giving (x,y) for Hilbert indices 0..n*n-1.
+    """
+    indices = np.zeros((n * n, 2), dtype=int)
+    for i in range(n * n):
+        x, y = hilbert_index_to_xy(n, i)
+        indices[i] = [x, y]
+    return indices
+
+
+def _sgn(v):
+    return (v > 0) - (v < 0)
+
+
+def _gilbert2d(x, y, ax, ay, bx, by, out):
+    """
+    Textbook recursive generalized Hilbert ("gilbert2d") curve: append
+    the (x, y) cells of the block spanned by the major vector (ax, ay)
+    and the minor vector (bx, by), starting at (x, y), to out.
+    """
+    w = abs(ax + ay)
+    h = abs(bx + by)
+    dax, day = _sgn(ax), _sgn(ay)
+    dbx, dby = _sgn(bx), _sgn(by)
+
+    if h == 1:
+        for _ in range(w):
+            out.append((x, y))
+            x, y = x + dax, y + day
+        return
+    if w == 1:
+        for _ in range(h):
+            out.append((x, y))
+            x, y = x + dbx, y + dby
+        return
+
+    ax2, ay2 = ax // 2, ay // 2
+    bx2, by2 = bx // 2, by // 2
+    w2 = abs(ax2 + ay2)
+    h2 = abs(bx2 + by2)
+
+    if 2 * w > 3 * h:
+        if (w2 % 2) and (w > 2):
+            ax2, ay2 = ax2 + dax, ay2 + day
+        _gilbert2d(x, y, ax2, ay2, bx, by, out)
+        _gilbert2d(x + ax2, y + ay2, ax - ax2, ay - ay2, bx, by, out)
+    else:
+        if (h2 % 2) and (h > 2):
+            bx2, by2 = bx2 + dbx, by2 + dby
+        _gilbert2d(x, y, bx2, by2, ax2, ay2, out)
+        _gilbert2d(x + bx2, y + by2, ax, ay, bx - bx2, by - by2, out)
+        _gilbert2d(x + (ax - dax) + (bx2 - dbx), y + (ay - day) + (by2 - dby),
+                   -bx2, -by2, -(ax - ax2), -(ay - ay2), out)
+
+
+def pseudo_hilbert_indices(M, N):
+    """
+    Reference traversal table for an M×N grid, as (row, col) pairs:
+    the original loop for power-of-two squares, the recursive gilbert2d
+    curve (x = column, y = row) for every other shape.
+    """
+    if M == N and M > 0 and (M & (M - 1)) == 0:
+        return generate_hilbert_indices(M)
+
+    cells = []
+    if N >= M:
+        _gilbert2d(0, 0, N, 0, 0, M, cells)
+    else:
+        _gilbert2d(0, 0, 0, M, N, 0, cells)
+
+    indices = np.zeros((M * N, 2), dtype=int)
+    for i, (x, y) in enumerate(cells):
+        indices[i] = [y, x]
+    return indices
+
+
+def cicsml_generate(length, a=None, b=None, p0=None, x0=None):
+    if a is None:
+        a = config.A
+    if b is None:
+        b = config.B
+    if p0 is None:
+        p0 = config.P0
+    if x0 is None:
+        x0 = config.X0
+
+    N_lattice = 9
+
+    p = float(p0)
+    x = (float(x0) + 0.001 * np.arange(N_lattice)) % 1.0
+
+    seq = []
+
+    for _ in range(config.TRANSIENT_ITER):
+        p = chebyshev_map(p, b)
+        x = logistic_sine_map(x, a, p)
+
+    while len(seq) < length:
+        p = chebyshev_map(p, b)
+        x = logistic_sine_map(x, a, p)
+        seq.extend(x.tolist())
+
+    return np.array(seq[:length])
+
+
+def synchronized_disorder_diffusion(I1, I2, I3,
+                                    IC1, IC2, Fmat,
+                                    D1, D2, D3, D4, D5, D6, D7, D8):
+    M, N = I1.shape
+    L = M * N
+
+    v1 = I1.reshape(-1, order='F').astype(np.uint8)
+    v2 = I2.reshape(-1, order='F').astype(np.uint8)
+    v3 = I3.reshape(-1, order='F').astype(np.uint8)
+
+    IC1 = np.asarray(IC1, dtype=np.int64)
+    IC2 = np.asarray(IC2, dtype=np.int64)
+
+    D1, D2, D3, D4, D5, D6, D7, D8 = (
+        _keystream(D, L) for D in (D1, D2, D3, D4, D5, D6, D7, D8)
+    )
+
+    d7_const = D7[L - 1]
+    d8_const = D8[L - 1]
+
+    TR = np.zeros(L, dtype=np.uint8)
+    TG = np.zeros(L, dtype=np.uint8)
+    TB = np.zeros(L, dtype=np.uint8)
+
+    for n in range(L):
+        i = IC1[n]
+
+        if n == 0:
+            TR[n] = v1[i] ^ d7_const ^ d8_const ^ D1[0]
+            TG[n] = v2[i] ^ d7_const ^ d8_const ^ D3[0]
+            TB[n] = v3[i] ^ d7_const ^ d8_const ^ D5[0]
+
+        elif n == 1:
+            TR[n] = v1[i] ^ d7_const ^ TR[n - 1] ^ D1[0]
+            TG[n] = v2[i] ^ d7_const ^ TG[n - 1] ^ D3[0]
+            TB[n] = v3[i] ^ d7_const ^ TB[n - 1] ^ D5[0]
+
+        else:
+            j = n - 1
+
+            TR[n] = v1[i] ^ TR[n - 2] ^ TR[n - 1] ^ D1[j]
+
+            TG[n] = v2[i] ^ TR[n - 2] ^ TG[n - 1] ^ D3[j]
+
+            TB[n] = v3[i] ^ TB[n - 2] ^ TB[n - 1] ^ D5[j]
+
+    F = np.asarray(Fmat, dtype=np.int64)
+    c, d = F[1]
+
+    mod_val = max(L - 1, 1)
+    idxs = np.arange(L, dtype=np.int64)
+    k_all = (c * idxs + d) % mod_val
+
+    CR = np.zeros(L, dtype=np.uint8)
+    CG = np.zeros(L, dtype=np.uint8)
+    CB = np.zeros(L, dtype=np.uint8)
+
+    for n in range(L):
+        i = IC2[n]
+        k = k_all[n]
+
+        if n == 0:
+            CR[n] = TR[i] ^ d7_const ^ d8_const ^ D2[0]
+            CG[n] = TG[i] ^ d7_const ^ d8_const ^ D4[0]
+            CB[n] = TB[i] ^ d7_const ^ d8_const ^ D6[0]
+
+        elif n == 1:
+            CR[n] = TR[i] ^ d7_const ^ CR[n - 1] ^ D2[0]
+            CG[n] = TG[i] ^ d7_const ^ CG[n - 1] ^ D4[0]
+            CB[n] = TB[i] ^ d7_const ^ CB[n - 1] ^ D6[0]
+
+        else:
+            CR[n] = TR[i] ^ CR[n - 2] ^ CR[n - 1] ^ D2[k]
+            CG[n] = TG[i] ^ CG[n - 2] ^ CG[n - 1] ^ D4[k]
+            CB[n] = TB[i] ^ CB[n - 2] ^ CB[n - 1] ^ D6[k]
+
+    CR_mat = CR.reshape(M, N, order='F')
+    CG_mat = CG.reshape(M, N, order='F')
+    CB_mat = CB.reshape(M, N, order='F')
+
+    return CR_mat, CG_mat, CB_mat
+
+
+def synchronized_disorder_diffusion_decrypt(CR_mat, CG_mat, CB_mat,
+                                            IC1, IC2, Fmat,
+                                            D1, D2, D3, D4, D5, D6, D7, D8):
+    M, N = CR_mat.shape
+    L = M * N
+
+    CR = CR_mat.reshape(-1, order='F').astype(np.uint8)
+    CG = CG_mat.reshape(-1, order='F').astype(np.uint8)
+    CB = CB_mat.reshape(-1, order='F').astype(np.uint8)
+
+    IC1 = np.asarray(IC1, dtype=np.int64)
+    IC2 = np.asarray(IC2, dtype=np.int64)
+
+    D1, D2, D3, D4, D5, D6, D7, D8 = (
+        _keystream(D, L) for D in (D1, D2, D3, D4, D5, D6, D7, D8)
+    )
+
+    d7_const = D7[L - 1]
+    d8_const = D8[L - 1]
+
+    # ---------- REVERSE SECOND STAGE ----------
+    TR_perm = np.zeros(L, dtype=np.uint8)
+    TG_perm = np.zeros(L, dtype=np.uint8)
+    TB_perm = np.zeros(L, dtype=np.uint8)
+
+    F = np.asarray(Fmat, dtype=np.int64)
+    c, d = F[1]
+
+    mod_val = max(L - 1, 1)
+    idxs = np.arange(L, dtype=np.int64)
+    k_all = (c * idxs + d) % mod_val
+
+    for n in range(L):
+
+        if n == 0:
+            TR_perm[n] = CR[n] ^ d7_const ^ d8_const ^ D2[0]
+            TG_perm[n] = CG[n] ^ d7_const ^ d8_const ^ D4[0]
+            TB_perm[n] = CB[n] ^ d7_const ^ d8_const ^ D6[0]
+
+        elif n == 1:
+            TR_perm[n] = CR[n] ^ d7_const ^ CR[n - 1] ^ D2[0]
+            TG_perm[n] = CG[n] ^ d7_const ^ CG[n - 1] ^ D4[0]
+            TB_perm[n] = CB[n] ^ d7_const ^ CB[n - 1] ^ D6[0]
+
+        else:
+            k = k_all[n]
+            TR_perm[n] = CR[n] ^ CR[n - 2] ^ CR[n - 1] ^ D2[k]
+            TG_perm[n] = CG[n] ^ CG[n - 2] ^ CG[n - 1] ^ D4[k]
+            TB_perm[n] = CB[n] ^ CB[n - 2] ^ CB[n - 1] ^ D6[k]
+
+    TR = np.zeros(L, dtype=np.uint8)
+    TG = np.zeros(L, dtype=np.uint8)
+    TB = np.zeros(L, dtype=np.uint8)
+
+    for n in range(L):
+        TR[IC2[n]] = TR_perm[n]
+        TG[IC2[n]] = TG_perm[n]
+        TB[IC2[n]] = TB_perm[n]
+
+    # ---------- REVERSE FIRST STAGE ----------
+    v1_perm = np.zeros(L, dtype=np.uint8)
+    v2_perm = np.zeros(L, dtype=np.uint8)
+    v3_perm = np.zeros(L, dtype=np.uint8)
+
+    for n in range(L):
+
+        if n == 0:
+            v1_perm[n] = TR[n] ^ d7_const ^ d8_const ^ D1[0]
+            v2_perm[n] = TG[n] ^ d7_const ^ d8_const ^ D3[0]
+            v3_perm[n] = TB[n] ^ d7_const ^ d8_const ^ D5[0]
+
+        elif n == 1:
+            v1_perm[n] = TR[n] ^ d7_const ^ TR[n - 1] ^ D1[0]
+            v2_perm[n] = TG[n] ^ d7_const ^ TG[n - 1] ^ D3[0]
+            v3_perm[n] = TB[n] ^ d7_const ^ TB[n - 1] ^ D5[0]
+
+        else:
+            j = n - 1
+            v1_perm[n] = TR[n] ^ TR[n - 2] ^ TR[n - 1] ^ D1[j]
+            v2_perm[n] = TG[n] ^ TR[n - 2] ^ TG[n - 1] ^ D3[j]
+            v3_perm[n] = TB[n] ^ TB[n - 2] ^ TB[n - 1] ^ D5[j]
+
+    v1 = np.zeros(L, dtype=np.uint8)
+    v2 = np.zeros(L, dtype=np.uint8)
+    v3 = np.zeros(L, dtype=np.uint8)
+
+    for n in range(L):
+        v1[IC1[n]] = v1_perm[n]
+        v2[IC1[n]] = v2_perm[n]
+        v3[IC1[n]] = v3_perm[n]
+
+    I1 = v1.reshape(M, N, order='F')
+    I2 = v2.reshape(M, N, order='F')
+    I3 = v3.reshape(M, N, order='F')
+
+    return I1, I2, I3
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+import config
+from modules.key_schedule import (ALGORITHM_VERSION, KeySchedule,
+                                  build_key_schedule)
+
+
+# ==========================================================
+# PERSISTENT KEY SCHEDULE STORE
+# ==========================================================
+
+_ARRAYS = ("IC1", "IC2", "Fmat",
+           "D1", "D2", "D3", "D4", "D5", "D6", "D7", "D8")
+
+
+# Entry names must not be the SHA-384 of the key itself: that digest is
+# exactly what derive_key_parts turns into the key material.
+_NAME_DOMAIN = b"miec-schedule-store\0"
+
+
+def _entry_name(user_key: str, H, W):
+    digest = hashlib.sha384(_NAME_DOMAIN + user_key.encode()).hexdigest()
+    return f"{digest}_{H}x{W}_v{ALGORITHM_VERSION}"
+
+
+def _dir_size(path):
+    total = 0
+    for name in os.listdir(path):
+        total += os.path.getsize(os.path.join(path, name))
+    return total
+
+
+class ScheduleStore:
+    """
+    On-disk cache of KeySchedules keyed by (domain-separated SHA-384 of
+    the key, H, W, ALGORITHM_VERSION). The root is kept private (0700):
+    entries hold the keystreams themselves. Each entry is a directory of .npy files opened
+    with np.load(mmap_mode='r'), so every process reading the same entry
+    shares the page cache instead of holding its own copy.
+
+    Entries are written to a temporary directory and renamed into place,
+    so readers never see a partial entry. When the store grows past
+    max_bytes the least recently used entries are removed.
+    """
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root if root is not None else config.SCHEDULE_STORE_PATH
+        self.max_bytes = (max_bytes if max_bytes is not None
+                          else config.SCHEDULE_STORE_MAX_BYTES)
+        os.makedirs(self.root, mode=0o700, exist_ok=True)
+        os.chmod(self.root, 0o700)
+
+    def get(self, user_key: str, H, W):
+        """
+        Return the stored KeySchedule (memory-mapped, read-only) or None.
+        """
+        path = os.path.join(self.root, _entry_name(user_key, H, W))
+        try:
+            arrays = {name: np.load(os.path.join(path, name + ".npy"),
+                                    mmap_mode="r")
+                      for name in _ARRAYS}
+        except FileNotFoundError:
+            return None
+
+        # mark as recently used for eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        return KeySchedule(
+            H, W, arrays["IC1"], arrays["IC2"], arrays["Fmat"],
+            tuple(arrays[f"D{i}"] for i in range(1, 9))
+        )
+
+    def put(self, user_key: str, ks: KeySchedule):
+        name = _entry_name(user_key, ks.H, ks.W)
+        final = os.path.join(self.root, name)
+        if os.path.isdir(final):
+            return
+
+        tmp = tempfile.mkdtemp(prefix=".tmp_", dir=self.root)
+        try:
+            for arr_name in _ARRAYS:
+                np.save(os.path.join(tmp, arr_name + ".npy"),
+                        np.ascontiguousarray(getattr(ks, arr_name)))
+            os.rename(tmp, final)
+        except OSError:
+            # another worker renamed the same entry into place first
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(final):
+                raise
+
+        self.evict()
+
+    def get_or_build(self, user_key: str, H, W):
+        ks = self.get(user_key, H, W)
+        if ks is None:
+            built = build_key_schedule(user_key, H, W)
+            self.put(user_key, built)
+            # the new entry may already be evicted if it alone exceeds max_bytes
+            ks = self.get(user_key, H, W) or built
+        return ks
+
+    def evict(self):
+        """
+        Remove least recently used entries until the store fits max_bytes.
+        """
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), _dir_size(path), path))
+            except FileNotFoundError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            # rename first so readers never open a half-deleted entry;
+            # already-open memmaps stay valid after the unlink
+            doomed = tempfile.mkdtemp(prefix=".del_", dir=self.root)
+            try:
+                os.rename(path, os.path.join(doomed, "entry"))
+            except OSError:
+                os.rmdir(doomed)
+                continue
+            shutil.rmtree(doomed, ignore_errors=True)
+            total -= size
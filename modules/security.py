@@ -1,6 +1,5 @@
 import numpy as np
-import cv2
-import math
+from modules import metrics
 
 
 # -------- ENTROPY --------
@@ -10,21 +9,16 @@ def entropy(image):
     Calculate Shannon entropy of an image
     """
 
-    hist = cv2.calcHist([image], [0], None, [256], [0, 256])
-    hist = hist / hist.sum()
-
-    ent = 0
-    for p in hist:
-        if p > 0:
-            ent -= p * math.log2(p)
-
-    return float(ent)
+    return float(metrics.entropy_from_hist(histogram(image)))
 
 
 # -------- HISTOGRAM ANALYSIS --------
 
 def histogram(image):
-    return cv2.calcHist([image], [0], None, [256], [0, 256])
+    """
+    256-bin histogram (float32 counts) of the first channel
+    """
+    return metrics.channel_histograms(image)[0].astype(np.float32)
 
 
 # -------- NPCR --------
@@ -62,14 +56,10 @@ def correlation(image):
     Adjacent pixel correlation
     """
 
-    img = image.flatten()
-
-    x = img[:-1]
-    y = img[1:]
-
-    corr = np.corrcoef(x, y)[0, 1]
+    # pairs run along the flattened image, so they wrap across rows
+    img = np.ravel(image)
 
-    return corr
+    return float(metrics.adjacent_correlation(img[None, :], "horizontal")[0])
 
 
 # -------- KEY SENSITIVITY --------
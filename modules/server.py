@@ -0,0 +1,476 @@
+import argparse
+import asyncio
+import json
+import os
+import struct
+import sys
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import config
+from modules import batch
+from modules import decryption
+from modules import encryption
+from modules.container import PALETTE_BYTES, palette_bytes
+from modules.key_schedule import build_key_schedule
+from modules.workspace import DiffusionWorkspace
+
+
+# ==========================================================
+# WIRE FORMAT
+# ==========================================================
+#
+#   frame   = u32 header length, u32 payload length (big endian),
+#             JSON header, raw payload
+#
+#   request header  {"op": "encrypt" | "decrypt" | "stats",
+#                    "key": str, "H": int, "W": int}
+#   encrypt payload three H×W uint8 index planes, one after another
+#   decrypt payload (H, W, 3) uint8 cipher, then three 768-byte palettes
+#
+#   response header {"ok": true, ...} or {"ok": false, "error": str}
+#   encrypt payload (H, W, 3) uint8 cipher
+#   decrypt payload (3, H, W, 3) uint8 RGB images
+
+FRAME_HEAD = struct.Struct(">II")
+MAX_HEADER_BYTES = 64 * 1024
+OPS = ("encrypt", "decrypt", "stats")
+
+
+def payload_size(op, H, W):
+    if op == "encrypt":
+        return 3 * H * W
+    if op == "decrypt":
+        return 3 * H * W + 3 * PALETTE_BYTES
+    return 0
+
+
+def response_size(op, H, W):
+    # a decrypt answer (three RGB images) is three times its cipher
+    if op == "encrypt":
+        return 3 * H * W
+    if op == "decrypt":
+        return 9 * H * W
+    return 0
+
+
+async def read_frame(reader):
+    """
+    Read one frame; requests and responses share the
+    config.SERVER_MAX_PAYLOAD limit (the server refuses requests whose
+    response would exceed it).
+    """
+    head = await reader.readexactly(FRAME_HEAD.size)
+    header_len, payload_len = FRAME_HEAD.unpack(head)
+    if header_len > MAX_HEADER_BYTES or payload_len > config.SERVER_MAX_PAYLOAD:
+        raise ValueError("frame too large")
+    header = json.loads(await reader.readexactly(header_len))
+    payload = await reader.readexactly(payload_len)
+    return header, payload
+
+
+def write_frame(writer, header, payload=b""):
+    raw = json.dumps(header).encode()
+    writer.write(FRAME_HEAD.pack(len(raw), len(payload)))
+    writer.write(raw)
+    if payload:
+        writer.write(payload)
+
+
+# ==========================================================
+# WORKER SIDE
+# ==========================================================
+
+# Per-process LRUs of key schedules (per key and size) and diffusion
+# workspaces (per size), so a key seen in an earlier batch is not rebuilt
+# either; both are capped at config.SERVER_SCHEDULE_CACHE entries.
+_schedules = OrderedDict()
+_workspaces = OrderedDict()
+
+
+def _worker_schedule(key, H, W):
+    return batch.lru_lookup(_schedules, (key, H, W),
+                            lambda: build_key_schedule(key, H, W),
+                            config.SERVER_SCHEDULE_CACHE)
+
+
+def _worker_workspace(H, W):
+    return batch.lru_lookup(_workspaces, (H, W),
+                            lambda: DiffusionWorkspace(H, W),
+                            config.SERVER_SCHEDULE_CACHE)
+
+
+def _run_group(key, H, W, items):
+    """
+    Run one micro-batch of (op, payload) requests that share key and
+    size, with a single key schedule. Returns [(ok, bytes or error)].
+    """
+    ks = _worker_schedule(key, H, W)
+    ws = _worker_workspace(H, W)
+    L = H * W
+
+    results = []
+    for op, payload in items:
+        try:
+            if op == "encrypt":
+                planes = np.frombuffer(payload, dtype=np.uint8).reshape(3, H, W)
+                C = encryption.encrypt_three_images(*planes, ks, workspace=ws)
+                results.append((True, C.tobytes()))
+            else:
+                C = np.frombuffer(payload, dtype=np.uint8,
+                                  count=3 * L).reshape(H, W, 3)
+                palettes = np.frombuffer(payload, dtype=np.uint8,
+                                         offset=3 * L).reshape(3, PALETTE_BYTES)
+                out = np.empty((3, H, W, 3), dtype=np.uint8)
+                decryption.decrypt_three_images(C, ks, *palettes,
+                                                out=out, workspace=ws)
+                results.append((True, out.tobytes()))
+        except Exception as e:
+            results.append((False, f"{type(e).__name__}: {e}"))
+    return results
+
+
+# ==========================================================
+# LATENCY
+# ==========================================================
+
+class LatencyStats:
+    """
+    Rolling window of request latencies (seconds).
+    """
+
+    def __init__(self, window=10000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def percentiles(self, ps=(50, 90, 99)):
+        """
+        {"count", "p50_ms", ..., "max_ms"} over the current window.
+        """
+        result = {"count": self.count}
+        if self.samples:
+            values = np.fromiter(self.samples, dtype=np.float64) * 1e3
+            for p in ps:
+                result[f"p{p}_ms"] = float(np.percentile(values, p))
+            result["max_ms"] = float(values.max())
+        return result
+
+
+# ==========================================================
+# SERVER
+# ==========================================================
+
+class _Request:
+    __slots__ = ("op", "key", "H", "W", "payload", "future")
+
+    def __init__(self, op, key, H, W, payload, future):
+        self.op = op
+        self.key = key
+        self.H = H
+        self.W = W
+        self.payload = payload
+        self.future = future
+
+
+class EncryptionServer:
+    """
+    Local encryption service. Requests wait in a bounded queue (a full
+    queue stops the connection handlers from reading, which pushes back
+    on clients); a dispatcher drains it in micro-batches, groups requests
+    by (key, H, W) and runs each group as one process-pool job, so the
+    group shares one key schedule. At most max_in_flight groups run at
+    once. Latencies are measured from frame receipt to response.
+    """
+
+    def __init__(self, workers=None, max_queue=None, max_batch=None,
+                 batch_window=None, max_in_flight=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue or config.SERVER_MAX_QUEUE
+        self.max_batch = max_batch or config.SERVER_MAX_BATCH
+        self.batch_window = (config.SERVER_BATCH_WINDOW
+                             if batch_window is None else batch_window)
+        self.max_in_flight = max_in_flight or 2 * self.workers
+        self.latency = {op: LatencyStats() for op in OPS[:2]}
+        self.batches = 0
+        self._queue = None
+        self._slots = None
+        self._pool = None
+        self._dispatcher = None
+        self._running = set()
+        self._servers = []
+        self._connections = {}
+
+    # ----- lifecycle -----
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._dispatcher = asyncio.get_running_loop().create_task(
+            self._dispatch())
+
+    async def listen_unix(self, path):
+        server = await asyncio.start_unix_server(self._handle, path=path)
+        self._servers.append(server)
+        return server
+
+    async def listen_tcp(self, port, host="127.0.0.1"):
+        if host not in ("127.0.0.1", "::1", "localhost"):
+            raise ValueError("the service only listens on localhost")
+        server = await asyncio.start_server(self._handle, host, port)
+        self._servers.append(server)
+        return server
+
+    async def close(self):
+        for server in self._servers:
+            server.close()
+        # closing the transports ends each handler's read loop
+        for writer in list(self._connections.values()):
+            writer.transport.abort()
+        if self._connections:
+            await asyncio.gather(*self._connections, return_exceptions=True)
+        for server in self._servers:
+            await server.wait_closed()
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+        # let in-flight pool jobs finish, then shut the pool down off the
+        # event loop thread
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        if self._pool is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._pool.shutdown)
+
+    # ----- requests -----
+
+    async def submit(self, op, key, H, W, payload):
+        """
+        Queue one encrypt / decrypt request and wait for its result bytes.
+        Blocks (asynchronously) while the queue is full.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Request(op, key, H, W, payload, future))
+        return await future
+
+    def stats(self):
+        return {
+            "latency": {op: s.percentiles() for op, s in self.latency.items()},
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batches": self.batches,
+        }
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch_ = [await self._queue.get()]
+        deadline = loop.time() + self.batch_window
+        while len(batch_) < self.max_batch:
+            if not self._queue.empty():
+                batch_.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch_.append(await asyncio.wait_for(self._queue.get(),
+                                                     timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch_
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            groups = defaultdict(list)
+            for req in await self._next_batch():
+                groups[(req.key, req.H, req.W)].append(req)
+
+            for (key, H, W), reqs in groups.items():
+                await self._slots.acquire()
+                self.batches += 1
+                # keep a reference until done, so the task is not collected
+                task = loop.create_task(self._run(key, H, W, reqs))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _run(self, key, H, W, reqs):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                self._pool, _run_group, key, H, W,
+                [(r.op, r.payload) for r in reqs])
+        except Exception as e:
+            results = [(False, f"{type(e).__name__}: {e}")] * len(reqs)
+        finally:
+            self._slots.release()
+
+        for req, result in zip(reqs, results):
+            if not req.future.done():
+                req.future.set_result(result)
+
+    # ----- connections -----
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                try:
+                    header, payload = await read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                start = time.perf_counter()
+                response = await self._serve(header, payload)
+                write_frame(writer, *response)
+                await writer.drain()
+                # an ok response implies a well-formed header
+                if response[0].get("ok") and header["op"] in self.latency:
+                    self.latency[header["op"]].add(time.perf_counter() - start)
+        except (ValueError, ConnectionError) as e:
+            try:
+                write_frame(writer, {"ok": False, "error": str(e)})
+                await writer.drain()
+            except ConnectionError:
+                pass
+        finally:
+            del self._connections[task]
+            writer.close()
+
+    async def _serve(self, header, payload):
+        if not isinstance(header, dict):
+            return {"ok": False, "error": "header must be a JSON object"}, b""
+        op = header.get("op")
+        if op == "stats":
+            return {"ok": True, "stats": self.stats()}, b""
+        if op not in OPS:
+            return {"ok": False, "error": f"unknown op {op!r}"}, b""
+
+        try:
+            key = str(header["key"])
+            H, W = int(header["H"]), int(header["W"])
+        except (KeyError, TypeError, ValueError):
+            return {"ok": False, "error": "header needs key, H and W"}, b""
+        if H < 1 or W < 1 or len(payload) != payload_size(op, H, W):
+            return {"ok": False,
+                    "error": f"payload must be {payload_size(op, H, W)} bytes "
+                             f"for {op} of {H}x{W}"}, b""
+        if response_size(op, H, W) > config.SERVER_MAX_PAYLOAD:
+            return {"ok": False,
+                    "error": f"{op} of {H}x{W} exceeds the "
+                             f"{config.SERVER_MAX_PAYLOAD}-byte frame limit"}, b""
+
+        ok, result = await self.submit(op, key, H, W, payload)
+        if not ok:
+            return {"ok": False, "error": result}, b""
+        return {"ok": True, "H": H, "W": W}, result
+
+
+# ==========================================================
+# CLIENT
+# ==========================================================
+
+class Client:
+    """
+    Minimal asyncio client; one request at a time per connection (open
+    several clients for concurrency).
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect_unix(cls, path):
+        return cls(*await asyncio.open_unix_connection(path))
+
+    @classmethod
+    async def connect_tcp(cls, port, host="127.0.0.1"):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def _call(self, header, payload=b""):
+        write_frame(self.writer, header, payload)
+        await self.writer.drain()
+        response, data = await read_frame(self.reader)
+        if not response.get("ok"):
+            raise RuntimeError(response.get("error", "request failed"))
+        return response, data
+
+    async def encrypt(self, key, I1, I2, I3):
+        H, W = I1.shape
+        payload = b"".join(np.ascontiguousarray(I, dtype=np.uint8).tobytes()
+                           for I in (I1, I2, I3))
+        _, data = await self._call({"op": "encrypt", "key": key,
+                                    "H": H, "W": W}, payload)
+        return np.frombuffer(data, dtype=np.uint8).reshape(H, W, 3)
+
+    async def decrypt(self, key, C, MAP1, MAP2, MAP3):
+        H, W = C.shape[0], C.shape[1]
+        payload = (np.ascontiguousarray(C, dtype=np.uint8).tobytes()
+                   + b"".join(palette_bytes(p) for p in (MAP1, MAP2, MAP3)))
+        _, data = await self._call({"op": "decrypt", "key": key,
+                                    "H": H, "W": W}, payload)
+        P = np.frombuffer(data, dtype=np.uint8).reshape(3, H, W, 3)
+        return P[0], P[1], P[2]
+
+    async def stats(self):
+        response, _ = await self._call({"op": "stats"})
+        return response["stats"]
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+# ==========================================================
+# COMMAND LINE
+# ==========================================================
+
+async def serve(socket_path=None, port=None, workers=None):
+    server = EncryptionServer(workers=workers)
+    await server.start()
+    if socket_path is not None:
+        await server.listen_unix(socket_path)
+        print(f"[LISTEN] unix:{socket_path}")
+    else:
+        await server.listen_tcp(port)
+        print(f"[LISTEN] 127.0.0.1:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print(json.dumps(server.stats()))
+        await server.close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m modules.server",
+        description="Local encryption service (Unix socket or localhost TCP)."
+    )
+    where = parser.add_mutually_exclusive_group()
+    where.add_argument("--socket", default=config.SERVER_SOCKET_PATH,
+                       help="Unix socket path")
+    where.add_argument("--port", type=int,
+                       help="listen on 127.0.0.1:PORT instead")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    socket_path = None if args.port is not None else args.socket
+    try:
+        asyncio.run(serve(socket_path, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import config
+from modules import encryption
+from modules import decryption
+from modules.key_schedule import build_key_schedule
+from modules.workspace import DiffusionWorkspace
+
+
+# ==========================================================
+# TILE LAYOUT / SUB-KEYS
+# ==========================================================
+
+def padded_shape(H, W, tile=None):
+    """
+    Cipher shape for an H×W image: both sides rounded up to whole tiles.
+    """
+    if tile is None:
+        tile = config.TILE_SIZE
+    return -(-H // tile) * tile, -(-W // tile) * tile
+
+
+def tile_grid(H, W, tile=None):
+    if tile is None:
+        tile = config.TILE_SIZE
+    Hp, Wp = padded_shape(H, W, tile)
+    return [(ty, tx) for ty in range(Hp // tile) for tx in range(Wp // tile)]
+
+
+def tile_key(user_key: str, ty, tx):
+    """
+    Per-tile key: every tile gets its own schedule, so identical tiles
+    never share a keystream.
+    """
+    return hashlib.sha384(f"{user_key}/tile/{ty}/{tx}".encode()).hexdigest()
+
+
+def _check_key(user_key):
+    # tile schedules are derived from the key string (see tile_key), so a
+    # prebuilt KeySchedule cannot stand in for it
+    if not isinstance(user_key, str):
+        raise ValueError(
+            "Tiled encryption needs the key string, got "
+            f"{type(user_key).__name__}"
+        )
+
+
+def _open(a, mode):
+    if isinstance(a, (str, os.PathLike)):
+        return np.load(a, mmap_mode=mode)
+    return a
+
+
+def create_plane_file(path, shape):
+    """
+    Create a zero-filled uint8 .npy file to be written tile by tile.
+    """
+    arr = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8,
+                                    shape=shape)
+    del arr
+    return path
+
+
+# ==========================================================
+# SINGLE TILE
+# ==========================================================
+
+def _read_tile(I, y0, x0, tile):
+    t = np.zeros((tile, tile), dtype=np.uint8)
+    src = I[y0:y0 + tile, x0:x0 + tile]
+    t[:src.shape[0], :src.shape[1]] = src
+    return t
+
+
+def _encrypt_tile(I1, I2, I3, user_key, C, ty, tx, tile, ws=None):
+    y0, x0 = ty * tile, tx * tile
+    planes = [_read_tile(I, y0, x0, tile) for I in (I1, I2, I3)]
+
+    ks = build_key_schedule(tile_key(user_key, ty, tx), tile, tile)
+    encryption.synchronized_disorder_diffusion(
+        *planes, ks.IC1, ks.IC2, ks.Fmat, *ks.keystreams,
+        out=C[y0:y0 + tile, x0:x0 + tile], workspace=ws
+    )
+
+
+def _decrypt_tile(C, user_key, O1, O2, O3, ty, tx, tile, ws=None):
+    y0, x0 = ty * tile, tx * tile
+    H, W = O1.shape
+    h, w = min(tile, H - y0), min(tile, W - x0)
+
+    ks = build_key_schedule(tile_key(user_key, ty, tx), tile, tile)
+    CT = C[y0:y0 + tile, x0:x0 + tile]
+    planes = decryption.synchronized_disorder_diffusion_decrypt(
+        CT[:, :, 0], CT[:, :, 1], CT[:, :, 2],
+        ks.IC1, ks.IC2, ks.Fmat, *ks.keystreams, workspace=ws
+    )
+    for O, P in zip((O1, O2, O3), planes):
+        O[y0:y0 + h, x0:x0 + w] = P[:h, :w]
+
+
+def _encrypt_tile_job(job):
+    paths, user_key, out_path, ty, tx, tile = job
+    I1, I2, I3 = (_open(p, "r") for p in paths)
+    C = _open(out_path, "r+")
+    _encrypt_tile(I1, I2, I3, user_key, C, ty, tx, tile)
+    C.flush()
+
+
+def _decrypt_tile_job(job):
+    cipher_path, user_key, out_paths, ty, tx, tile = job
+    C = _open(cipher_path, "r")
+    O1, O2, O3 = (_open(p, "r+") for p in out_paths)
+    _decrypt_tile(C, user_key, O1, O2, O3, ty, tx, tile)
+    for O in (O1, O2, O3):
+        O.flush()
+
+
+def _run_tiles(job, jobs, workers):
+    chunksize = max(1, len(jobs) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for _ in pool.map(job, jobs, chunksize=chunksize):
+            pass
+
+
+def _check_paths(workers, *args):
+    if workers > 1 and not all(isinstance(a, (str, os.PathLike)) for a in args):
+        raise ValueError("workers > 1 needs .npy paths so tiles can be "
+                         "memory-mapped by each worker")
+
+
+# ==========================================================
+# TILED ENCRYPT / DECRYPT
+# ==========================================================
+
+def encrypt_tiled(I1, I2, I3, user_key: str, out, tile=None, workers=1):
+    """
+    Encrypt three H×W index planes tile by tile.
+
+    I1..I3 are 2-D uint8 arrays or paths to .npy files; out is an array
+    or .npy path of shape padded_shape(H, W, tile) + (3,) (see
+    create_plane_file). Each tile is encrypted with the schedule of
+    tile_key(user_key, ty, tx), so peak memory depends on the tile size
+    only. With workers > 1 all arguments must be paths; tiles are then
+    spread over a process pool and written into the memory-mapped output.
+    """
+    _check_key(user_key)
+    if tile is None:
+        tile = config.TILE_SIZE
+    H, W = _open(I1, "r").shape
+    tiles = tile_grid(H, W, tile)
+
+    if workers > 1:
+        _check_paths(workers, I1, I2, I3, out)
+        jobs = [((I1, I2, I3), user_key, out, ty, tx, tile)
+                for ty, tx in tiles]
+        _run_tiles(_encrypt_tile_job, jobs, workers)
+        return out
+
+    A1, A2, A3 = (_open(I, "r") for I in (I1, I2, I3))
+    C = _open(out, "r+")
+    ws = DiffusionWorkspace(tile, tile)
+    for ty, tx in tiles:
+        _encrypt_tile(A1, A2, A3, user_key, C, ty, tx, tile, ws)
+    if isinstance(C, np.memmap):
+        C.flush()
+    return out
+
+
+def decrypt_tiled(C, user_key: str, out1, out2, out3, tile=None, workers=1):
+    """
+    Inverse of encrypt_tiled. out1..out3 are H×W uint8 arrays or .npy
+    paths; their shape gives the original image size (padding is dropped).
+    """
+    _check_key(user_key)
+    if tile is None:
+        tile = config.TILE_SIZE
+    H, W = _open(out1, "r").shape
+    tiles = tile_grid(H, W, tile)
+
+    if workers > 1:
+        _check_paths(workers, C, out1, out2, out3)
+        jobs = [(C, user_key, (out1, out2, out3), ty, tx, tile)
+                for ty, tx in tiles]
+        _run_tiles(_decrypt_tile_job, jobs, workers)
+        return out1, out2, out3
+
+    A = _open(C, "r")
+    O1, O2, O3 = (_open(o, "r+") for o in (out1, out2, out3))
+    ws = DiffusionWorkspace(tile, tile)
+    for ty, tx in tiles:
+        _decrypt_tile(A, user_key, O1, O2, O3, ty, tx, tile, ws)
+    for O in (O1, O2, O3):
+        if isinstance(O, np.memmap):
+            O.flush()
+    return out1, out2, out3
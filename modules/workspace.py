@@ -0,0 +1,110 @@
+import numpy as np
+
+
+# ==========================================================
+# REUSABLE DIFFUSION BUFFERS
+# ==========================================================
+
+class DiffusionWorkspace:
+    """
+    Scratch buffers for encrypting / decrypting M×N images. Passing the
+    same workspace to repeated calls of that size means the diffusion
+    stages allocate no new planes.
+
+    Planes are kept flattened column-major (the order the cipher works
+    in); T holds the three stage-one planes and V the three results.
+    """
+
+    __slots__ = ("M", "N", "L", "plane", "gather", "tap", "scan",
+                 "k_all", "_k_for", "T", "V")
+
+    def __init__(self, M, N):
+        L = M * N
+        self.M = M
+        self.N = N
+        self.L = L
+        self.plane = np.empty(L, dtype=np.uint8)
+        self.gather = np.empty(L, dtype=np.uint8)
+        self.tap = np.empty(L, dtype=np.uint8)
+        self.scan = np.zeros(L + (-L) % 3, dtype=np.uint8)
+        self.k_all = np.empty(L, dtype=np.int64)
+        self._k_for = None
+        self.T = np.empty((3, L), dtype=np.uint8)
+        self.V = np.empty((3, L), dtype=np.uint8)
+
+    def flatten(self, A, out):
+        """
+        Copy an M×N plane into the 1-D buffer out in column-major order.
+        Other dtypes are cast to uint8 like .astype(np.uint8) would.
+        """
+        np.copyto(out.reshape(self.N, self.M), A.T, casting="unsafe")
+        return out
+
+    def unflatten(self, v, out):
+        """
+        Copy a column-major 1-D plane into the M×N array (or view) out.
+        """
+        np.copyto(out.T, v.reshape(self.N, self.M))
+        return out
+
+    def planes(self, flat):
+        """
+        (3, M, N) view of three column-major flattened planes (no copy).
+        """
+        return flat.reshape(3, self.N, self.M).transpose(0, 2, 1)
+
+    def fill_k_all(self, Fmat):
+        """
+        Stage-two keystream positions k_all[n] = (c * n + d) mod (L - 1).
+        """
+        F = np.asarray(Fmat, dtype=np.int64)
+        c, d = int(F[1, 0]), int(F[1, 1])
+        k = self.k_all
+        if self._k_for == (c, d):
+            return k
+
+        # d, d + c, d + 2c, ... as a running sum, without an arange temporary
+        k.fill(c)
+        k[:1] = d
+        np.cumsum(k, out=k)
+        np.remainder(k, max(self.L - 1, 1), out=k)
+        self._k_for = (c, d)
+        return k
+
+    def shift_taps(self, D):
+        """
+        Stage-one taps D[max(n - 1, 0)] written into self.tap.
+        """
+        self.tap[:1] = D[:1]
+        self.tap[1:] = D[:self.L - 1]
+        return self.tap
+
+
+def as_output(out, shape):
+    """
+    uint8 array of the given shape for an out= argument: a fresh array
+    when out is None, otherwise a view of out (an ndarray or any writable
+    buffer such as a memoryview, bytearray or mmap).
+    """
+    if out is None:
+        return np.empty(shape, dtype=np.uint8)
+    if not isinstance(out, np.ndarray):
+        out = np.frombuffer(out, dtype=np.uint8)
+    if out.dtype != np.uint8 or out.size != np.prod(shape):
+        raise ValueError(f"out must hold {shape} uint8 values")
+    if out.shape == tuple(shape):
+        return out
+    if not out.flags.c_contiguous:
+        raise ValueError("out must be C-contiguous to be reshaped")
+    return out.reshape(shape)
+
+
+def resolve_workspace(workspace, M, N):
+    if workspace is None:
+        return DiffusionWorkspace(M, N)
+    if (workspace.M, workspace.N) != (M, N):
+        raise ValueError(
+            f"Workspace built for {workspace.M}x{workspace.N}, "
+            f"image is {M}x{N}"
+        )
+    return workspace